@@ -1,2 +1,3 @@
 from . import parser
 from . import compiler
+from . import cpu
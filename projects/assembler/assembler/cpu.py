@@ -0,0 +1,135 @@
+import array
+
+
+class CPU:
+    rom_size = 32 * 1024
+    ram_size = 32 * 1024
+
+    # the `a` bit and the zx, nx, zy, ny, f, no control bits of the ALU
+    _comp_bits = 7
+
+    def __init__(self):
+        self.rom = []
+        # built here, once per process, so that run() times only the
+        # execution
+        self._decode = _decode_table()
+        self.reset()
+
+    def reset(self):
+        self.pc = 0
+        self.A = 0
+        self.D = 0
+        self.ram = array.array('H', bytes(2 * self.ram_size))
+        self.cycles = 0
+        self.halted = False
+
+    def load(self, codes):
+        codes = list(codes)
+        if len(codes) > self.rom_size:
+            raise RuntimeError('the program does not fit into ROM')
+        self.rom = codes
+        self.pc = 0
+        self.halted = False
+
+    def load_file(self, path):
+        with open(path) as f:
+            self.load(self._read_codes(f))
+
+    def _read_codes(self, fobj):
+        for lineno, line in enumerate(fobj, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if len(line) != 16 or set(line) - {'0', '1'}:
+                raise RuntimeError('Invalid code: lineno: %s' % lineno)
+            yield int(line, 2)
+
+    def peek(self, address):
+        # the signed value of a RAM word
+        value = self.ram[address]
+        return value - 0x10000 if value & 0x8000 else value
+
+    def poke(self, address, value):
+        self.ram[address] = value & 0xffff
+
+    def run(self, max_steps=None):
+        # execute up to `max_steps` instructions, stop earlier if the pc
+        # leaves the ROM or the program enters the `(END) @END 0;JMP` loop
+        decode = self._decode
+        rom = self.rom
+        ram = self.ram
+        size = len(rom)
+        pc, A, D = self.pc, self.A, self.D
+
+        steps = 0
+        limit = float('inf') if max_steps is None else max_steps
+        while steps < limit and pc < size:
+            code = rom[pc]
+            steps += 1
+
+            if code < 0x8000:
+                A = code
+                pc += 1
+                continue
+
+            comp, reads_m, dest, jump = decode[code]
+            address = A & 0x7fff
+            out = comp(A, D, ram[address] if reads_m else 0)
+
+            # the jump target and M address are the A before the clock edge
+            target = A
+            if dest & 0b001:
+                ram[address] = out
+            if dest & 0b010:
+                D = out
+            if dest & 0b100:
+                A = out
+
+            if jump and jump & (0b100 if out & 0x8000 else 0b010 if not out else 0b001):
+                if target == pc - 1 and rom[target] == target:
+                    self.halted = True
+                    pc = target
+                    break
+                pc = target
+            else:
+                pc += 1
+
+        self.pc, self.A, self.D = pc, A, D
+        self.cycles += steps
+        return steps
+
+
+def _alu_expression(bits):
+    a, zx, nx, zy, ny, f, no = ((bits >> i) & 1 for i in reversed(range(7)))
+
+    x = '0' if zx else 'D'
+    if nx:
+        x = f'~{x}'
+    y = '0' if zy else ('M' if a else 'A')
+    if ny:
+        y = f'~{y}'
+    out = f'({x}) + ({y})' if f else f'({x}) & ({y})'
+    if no:
+        out = f'~({out})'
+    return f'({out}) & 0xffff', bool(a) and not zy
+
+
+_decoded = None
+
+
+def _decode_table():
+    # code -> (comp(A, D, M), reads M, dest bits, jump bits); 64K entries
+    # indexed by the whole instruction, A-instructions are not decoded
+    global _decoded
+    if _decoded is None:
+        comps = []
+        for bits in range(1 << CPU._comp_bits):
+            expression, reads_m = _alu_expression(bits)
+            comps.append((eval(f'lambda A, D, M: {expression}'), reads_m))
+
+        table = [None] * (1 << 16)
+        for code in range(0x8000, 1 << 16):
+            comp, reads_m = comps[(code >> 6) & 0x7f]
+            table[code] = (comp, reads_m, (code >> 3) & 0b111, code & 0b111)
+        _decoded = table
+    return _decoded
@@ -0,0 +1,81 @@
+import io
+
+import pytest
+
+from ..compiler import Compiler
+from ..cpu import CPU
+from .test_compiler import Instruction
+
+
+max_hack = '''
+    0000000000000000
+    1111110000010000
+    0000000000000001
+    1111010011010000
+    0000000000001010
+    1110001100000001
+    0000000000000001
+    1111110000010000
+    0000000000001100
+    1110101010000111
+    0000000000000000
+    1111110000010000
+    0000000000000010
+    1110001100001000
+    0000000000001110
+    1110101010000111
+'''
+
+
+@pytest.mark.parametrize('x,y', [(3, 5), (23456, 12345), (-1, -3)])
+def test_max(x, y):
+    cpu = CPU()
+    cpu.load(cpu._read_codes(io.StringIO(max_hack)))
+    cpu.poke(0, x)
+    cpu.poke(1, y)
+
+    cpu.run(100)
+
+    assert cpu.halted
+    assert cpu.peek(2) == max(x, y)
+
+
+def test_compiled_program():
+    prog = [
+        # sum = 0; i = 10; do { sum += i } while (--i)
+        Instruction({'itype': 'A', 'address': 'sum'}),
+        Instruction({'itype': 'C', 'dest': 'M', 'comp': ('const', '0'), 'jmp': None}),
+        Instruction({'itype': 'A', 'address': '10'}),
+        Instruction({'itype': 'C', 'dest': 'D', 'comp': ('val', 'A'), 'jmp': None}),
+        Instruction({'itype': 'A', 'address': 'i'}),
+        Instruction({'itype': 'C', 'dest': 'M', 'comp': ('val', 'D'), 'jmp': None}),
+        Instruction({'itype': 'label', 'name': 'LOOP'}),
+        Instruction({'itype': 'A', 'address': 'sum'}),
+        Instruction({'itype': 'C', 'dest': 'M', 'comp': ('+', 'D', 'M'), 'jmp': None}),
+        Instruction({'itype': 'A', 'address': 'i'}),
+        Instruction({'itype': 'C', 'dest': 'MD', 'comp': ('dec', 'M'), 'jmp': None}),
+        Instruction({'itype': 'A', 'address': 'LOOP'}),
+        Instruction({'itype': 'C', 'dest': None, 'comp': ('val', 'D'), 'jmp': 'JGT'}),
+        Instruction({'itype': 'label', 'name': 'END'}),
+        Instruction({'itype': 'A', 'address': 'END'}),
+        Instruction({'itype': 'C', 'dest': None, 'comp': ('const', '0'), 'jmp': 'JMP'}),
+    ]
+
+    cpu = CPU()
+    cpu.load(Compiler().compile(prog))
+    steps = cpu.run(1000)
+
+    assert cpu.halted
+    assert cpu.cycles == steps
+    assert cpu.peek(16) == sum(range(11))  # sum
+    assert cpu.peek(17) == 0  # i
+
+
+def test_max_steps():
+    cpu = CPU()
+    # @0 M=M+1 @0 0;JMP
+    cpu.load([0b0, 0b1111110111001000, 0b0, 0b1110101010000111])
+
+    assert cpu.run(400) == 400
+    assert not cpu.halted
+    assert cpu.peek(0) == 100
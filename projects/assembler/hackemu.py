@@ -0,0 +1,57 @@
+#! /bin/env python3
+
+import argparse
+import signal
+import sys
+import time
+
+from assembler.cpu import CPU
+
+
+def parse_assignment(value):
+    address, value = value.split('=')
+    return int(address), int(value)
+
+
+def parse_range(value):
+    first, _, last = value.partition('-')
+    return int(first), int(last or first)
+
+
+def main(args):
+    cpu = CPU()
+    cpu.load_file(args.input)
+    for address, value in args.set:
+        cpu.poke(address, value)
+
+    started = time.perf_counter()
+    steps = cpu.run(args.max_steps)
+    elapsed = time.perf_counter() - started
+
+    status = 'halted' if cpu.halted else f'stopped at pc={cpu.pc}'
+    print(f'{status} after {steps} instructions'
+        f' ({steps / max(elapsed, 1e-9) / 1e6:.2f}M instructions/s)')
+    for first, last in args.dump:
+        for address in range(first, last + 1):
+            print(f'RAM[{address}] = {cpu.peek(address)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='a Hack CPU emulator',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input', help='input .hack file')
+    parser.add_argument('--max-steps', '-n', type=int, default=10_000_000,
+        help='maximum number of instructions to execute')
+    parser.add_argument('--set', '-s', type=parse_assignment, action='append',
+        default=[], metavar='ADDR=VALUE', help='initialize a RAM word')
+    parser.add_argument('--dump', '-p', type=parse_range, action='append',
+        default=[], metavar='ADDR[-ADDR]', help='print out RAM words')
+
+    parsed_args = parser.parse_args()
+
+    try:
+        main(parsed_args)
+    except BrokenPipeError:
+        sys.exit(128 + signal.SIGPIPE)
+    except KeyboardInterrupt:
+        sys.exit(128 + signal.SIGINT)
@@ -13,7 +13,7 @@ def main(args):
     p = Parser()
     for path in args.input:
         if os.path.isdir(path):
-            for fname in glob.iglob(os.path.join(path, '*.jack')):
+            for fname in sorted(glob.iglob(os.path.join(path, '*.jack'))):
                 p.parse(fname)
         else:
             p.parse(path)
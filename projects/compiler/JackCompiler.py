@@ -1,32 +1,215 @@
 #! /bin/env python3
 
 import argparse
+import collections
+import concurrent.futures
+import difflib
 import glob
+import hashlib
+import itertools
 import os
+import pickle
 import signal
+import subprocess
 import sys
 
-from jack_compiler import Compiler
+import build_cache
+from jack_analyzer import AnalyzerError
+from jack_compiler import Compiler, CompilerError
+from jack_tokenizer import TokenizerError
 
 
-def main(args):
-    c = Compiler()
-    for path in args.input:
+def sources(paths):
+    for path in paths:
         if os.path.isdir(path):
-            for fname in glob.iglob(os.path.join(path, '*.jack')):
-                output_file = os.path.splitext(fname)[0] + '.vm'
-                c.compile(fname, output_file)
+            yield from sorted(glob.iglob(os.path.join(path, '*.jack')))
         else:
-            output_file = os.path.splitext(path)[0] + '.vm'
-            c.compile(path, output_file)
+            yield path
+
+
+def error_message(fname, e):
+    # file:line when the error knows its line
+    if isinstance(e, CompilerError):
+        return f'{fname}:{e.lineno}: {type(e).__name__}: {e}'
+    return f'{fname}: {type(e).__name__}: {e}'
+
+
+def compile_file(fname, output_file, subroutines=None, engine='visitor',
+        optimize=0):
+    # runs in the worker processes, returns the error message if any and
+    # the hits of the optimizer rules
+    compiler = Compiler(subroutines, engine, optimize)
+    try:
+        compiler.compile(fname, output_file)
+    except Exception as e:
+        return error_message(fname, e), compiler.stats
+    return None, compiler.stats
+
+
+def other_hash_seed():
+    # a hash seed other than the one of this interpreter
+    seed = os.environ.get('PYTHONHASHSEED', '')
+    return str((int(seed) + 1) % 2**32) if seed.isdigit() else '1'
+
+
+def compile_fresh(fname, subroutines=None, engine='visitor', optimize=0):
+    # the code of the file compiled by a new interpreter with another hash
+    # seed: the object ids and the order of the sets and dicts differ
+    result = subprocess.run(
+        [sys.executable, '-c',
+            'import JackCompiler; JackCompiler._compile_pickled()'],
+        input=pickle.dumps((os.path.abspath(fname), subroutines, engine,
+            optimize)),
+        capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, PYTHONHASHSEED=other_hash_seed()))
+    if result.returncode:
+        raise RuntimeError(result.stderr.decode().strip())
+    return pickle.loads(result.stdout)
+
+
+def _compile_pickled():
+    # the other end of compile_fresh
+    fname, subroutines, engine, optimize = pickle.load(sys.stdin.buffer)
+    code = list(Compiler(subroutines, engine, optimize).compile(fname))
+    pickle.dump(code, sys.stdout.buffer)
+
+
+def check_file(fname, subroutines=None, engine='visitor', optimize=0):
+    # compiles the file here and in a new interpreter, returns the
+    # differences if the code is not the same both times
+    first = list(Compiler(subroutines, engine, optimize).compile(fname))
+    second = compile_fresh(fname, subroutines, engine, optimize)
+    if first != second:
+        return '\n'.join(difflib.unified_diff(first, second, fname,
+            f'{fname} (new interpreter)', lineterm=''))
+    return None
+
+
+def check(files, args, subroutines):
+    # nothing is written, the cache is left alone
+    if args.jobs > 1 and len(files) > 1:
+        with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+            diffs = list(executor.map(check_file, files,
+                itertools.repeat(subroutines), itertools.repeat(args.engine),
+                itertools.repeat(args.optimize)))
+    else:
+        diffs = [check_file(fname, subroutines, args.engine, args.optimize)
+            for fname in files]
+
+    diffs = [diff for diff in diffs if diff is not None]
+    for diff in diffs:
+        print(diff, file=sys.stderr)
+    print(f'check: {len(files) - len(diffs)} of {len(files)} files'
+        ' reproducible', file=sys.stderr)
+    if diffs:
+        sys.exit(1)
+
+
+def subroutine_tables(files):
+    # the classes of the files that fail here are missing from the tables,
+    # the errors are returned
+    tables = {}
+    errors = []
+    for fname in files:
+        try:
+            class_name, table = Compiler().subroutine_table(fname)
+        except (TokenizerError, AnalyzerError, CompilerError) as e:
+            errors.append(error_message(fname, e))
+            continue
+        tables[class_name] = table
+    return tables, errors
+
+
+def main(args):
+    files = list(sources(args.input))
+    if args.clean:
+        for directory in sorted({os.path.dirname(fname) for fname in files}):
+            build_cache.clean(directory)
+
+    subroutines = None
+    options = [f'optimize:{args.optimize}']
+    if args.cross_class:
+        subroutines, errors = subroutine_tables(files)
+        if errors:
+            # the calls to the missing classes would compile wrong
+            for error in errors:
+                print(error, file=sys.stderr)
+            sys.exit(1)
+        # every class depends on the subroutines of the others
+        digest = hashlib.sha256(repr(sorted(subroutines.items())).encode())
+        options.append('cross-class:' + digest.hexdigest())
+    if args.check:
+        check(files, args, subroutines)
+        return
+
+    cache = None if args.no_cache else build_cache.BuildCache(options)
+    jobs = {}
+    for fname in files:
+        output_file = os.path.splitext(fname)[0] + '.vm'
+        key = None if cache is None else cache.lookup(fname, output_file)
+        if cache is None or key is not None:
+            jobs[fname] = (output_file, key)
+
+    if args.jobs > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+            results = list(executor.map(compile_file,
+                jobs, [output_file for output_file, _ in jobs.values()],
+                itertools.repeat(subroutines), itertools.repeat(args.engine),
+                itertools.repeat(args.optimize)))
+    else:
+        results = [compile_file(fname, output_file, subroutines, args.engine,
+                args.optimize)
+            for fname, (output_file, _) in jobs.items()]
+
+    errors = [error for error, _ in results]
+    stats = sum((stats for _, stats in results), collections.Counter())
+    for (fname, (output_file, key)), error in zip(jobs.items(), errors):
+        if error is not None:
+            print(error, file=sys.stderr)
+        elif cache is not None:
+            cache.store(fname, key, output_file)
+
+    if args.optimize:
+        for rule, hits in sorted(stats.items()):
+            print(f'{rule}: {hits} hits', file=sys.stderr)
+    if cache is not None:
+        cache.save()
+        print(f'cache: {cache.hits} hits, {cache.misses} misses',
+            file=sys.stderr)
+    if any(errors):
+        sys.exit(1)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='a jack compiler',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('input', nargs='+',
         help='input .jack files or directories containing .jack files')
+    parser.add_argument('--no-cache', action='store_true',
+        help='compile every file, do not read or update the build cache')
+    parser.add_argument('--clean', action='store_true',
+        help='drop the build cache of the input directories first')
+    parser.add_argument('--check', action='store_true',
+        help='compile every file twice, the second time in a new'
+            ' interpreter with another hash seed, and report the files whose'
+            ' code differs, without writing any output')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+        help='number of files to compile in parallel')
+    parser.add_argument('--engine', choices=Compiler.engines,
+        default='visitor',
+        help='compile from the syntax tree or while parsing (the same code)')
+    parser.add_argument('--cross-class', action='store_true',
+        help='resolve ClassName.fn() calls against the subroutines of all'
+            ' the input classes, not only of the calling class')
+    parser.add_argument('-O', dest='optimize', type=int,
+        choices=Compiler.levels, default=0,
+        help='optimization level: 1 runs the peephole optimizer over the'
+            ' generated code, 2 also folds the constant expressions and'
+            ' replaces the multiplications by small constants with additions;'
+            ' the hits per rewrite rule are reported')
 
     parsed_args = parser.parse_args()
+    if parsed_args.optimize >= 2 and parsed_args.engine == 'streaming':
+        parser.error('-O2 needs the syntax tree, use the visitor engine')
 
     try:
         main(parsed_args)
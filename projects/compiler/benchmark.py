@@ -0,0 +1,133 @@
+#! /bin/env python3
+
+import argparse
+import glob
+import os
+import signal
+import sys
+import time
+import tracemalloc
+
+from jack_analyzer import Analyzer
+from jack_compiler import Compiler
+from jack_tokenizer import Tokenizer
+from vm_emulator import VMEmulator, MaxStepsExceededError
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+os_dir = os.path.join(root, 'tools', 'OS')
+programs_dir = os.path.join(root, 'projects', '11')
+os_sources_dir = os.path.join(root, 'projects', '12')
+
+
+def vm_files(path):
+    for fname in sorted(glob.glob(os.path.join(path, '*.vm'))):
+        with open(fname) as f:
+            yield from f
+
+
+def compile_program(path):
+    c = Compiler()
+    for fname in sorted(glob.glob(os.path.join(path, '*.jack'))):
+        yield from c.compile(fname)
+
+
+def bench_vm(args):
+    for path in args.programs or sorted(glob.glob(os.path.join(programs_dir, '*'))):
+        program = list(compile_program(path)) + list(vm_files(os_dir))
+
+        vm = VMEmulator(os=args.os)
+        vm.load(program)
+
+        started = time.perf_counter()
+        try:
+            vm.execute(['call Sys.init 0'], max_steps=args.steps)
+            steps = None
+        except MaxStepsExceededError:
+            steps = args.steps
+        elapsed = time.perf_counter() - started
+
+        if steps is None:
+            print(f'{os.path.basename(path):15} finished in {elapsed:.3f}s')
+        else:
+            print(f'{os.path.basename(path):15} {steps / elapsed:12,.0f} commands/s')
+
+
+def bench_tree(args):
+    sources = sorted(glob.glob(os.path.join(args.sources, '*.jack')))
+    for link_parents in [True, False]:
+        tracemalloc.start()
+        started = time.perf_counter()
+        trees = [Analyzer(link_parents).start(Tokenizer().tokenize(fname))
+            for fname in sources]
+        elapsed = time.perf_counter() - started
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        nodes = 0
+        stack = list(trees)
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            stack.extend(node.children)
+        del trees
+
+        print(f'link_parents={link_parents!s:5} {nodes:6} nodes'
+            f' {memory / 1024:8.0f} KB ({peak / 1024:.0f} KB peak)'
+            f' {elapsed:.3f}s')
+
+
+def bench_compile(args):
+    sources = sorted(glob.glob(os.path.join(args.sources, '*.jack')))
+    for engine in Compiler.engines:
+        first = total = peak = 0
+        for fname in sources:
+            tracemalloc.start()
+            started = time.perf_counter()
+            code = Compiler(engine=engine).compile(fname)
+            next(code)
+            first += time.perf_counter() - started
+            for cmd in code:
+                pass
+            total += time.perf_counter() - started
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        print(f'{engine:10} first command {first * 1000:6.1f}ms'
+            f'  all {total * 1000:6.1f}ms  peak {peak / 1024:5.0f} KB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='jack toolchain benchmarks',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(required=True)
+
+    vm_parser = subparsers.add_parser('vm',
+        help='run compiled programs against tools/OS in the VM emulator')
+    vm_parser.add_argument('programs', nargs='*',
+        help='directories with .jack files (default: projects/11/*)')
+    vm_parser.add_argument('--steps', '-n', type=int, default=200_000,
+        help='number of VM commands to execute per program')
+    vm_parser.add_argument('--os', choices=VMEmulator.oses, default='native',
+        help='run the OS functions natively or from tools/OS')
+    vm_parser.set_defaults(bench=bench_vm)
+
+    tree_parser = subparsers.add_parser('tree',
+        help='memory and time to build the ASTs of the Jack sources')
+    tree_parser.add_argument('sources', nargs='?', default=os_sources_dir,
+        help='directory with .jack files (default: projects/12)')
+    tree_parser.set_defaults(bench=bench_tree)
+
+    compile_parser = subparsers.add_parser('compile',
+        help='latency and peak memory of the compiler engines per file')
+    compile_parser.add_argument('sources', nargs='?', default=os_sources_dir,
+        help='directory with .jack files (default: projects/12)')
+    compile_parser.set_defaults(bench=bench_compile)
+
+    parsed_args = parser.parse_args()
+
+    try:
+        parsed_args.bench(parsed_args)
+    except BrokenPipeError:
+        sys.exit(128 + signal.SIGPIPE)
+    except KeyboardInterrupt:
+        sys.exit(128 + signal.SIGINT)
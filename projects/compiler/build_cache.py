@@ -0,0 +1,83 @@
+import glob
+import hashlib
+import json
+import os
+
+manifest_name = '.jackcache.json'
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def compiler_version():
+    # any change of the compiler sources invalidates the cache
+    h = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for fname in sorted(glob.glob(os.path.join(here, '*.py'))):
+        if not os.path.basename(fname).startswith('test_'):
+            with open(fname, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class BuildCache:
+    # a manifest per source directory: source file name -> the hash of the
+    # source, the compiler version and the options, and the hash of the .vm
+    # emitted for it. A source is skipped when both still match.
+    def __init__(self, options=()):
+        self.version = compiler_version()
+        self.options = sorted(options)
+        self.hits = 0
+        self.misses = 0
+        self._manifests = {}
+
+    def _manifest(self, directory):
+        if directory not in self._manifests:
+            try:
+                with open(os.path.join(directory, manifest_name)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+            self._manifests[directory] = manifest
+        return self._manifests[directory]
+
+    def key(self, source):
+        with open(source, 'rb') as f:
+            data = f.read()
+        return _digest(json.dumps(
+            [_digest(data), self.version, self.options]).encode())
+
+    def lookup(self, source, output_file):
+        # the key to store if the output has to be rebuilt, None on a hit
+        key = self.key(source)
+        entry = self._manifest(os.path.dirname(source)).get(
+            os.path.basename(source))
+        if entry is not None and entry['key'] == key:
+            try:
+                with open(output_file, 'rb') as f:
+                    if _digest(f.read()) == entry['output']:
+                        self.hits += 1
+                        return None
+            except OSError:
+                pass
+        self.misses += 1
+        return key
+
+    def store(self, source, key, output_file):
+        with open(output_file, 'rb') as f:
+            output = _digest(f.read())
+        self._manifest(os.path.dirname(source))[os.path.basename(source)] = \
+            dict(key=key, output=output)
+
+    def save(self):
+        for directory, manifest in self._manifests.items():
+            with open(os.path.join(directory, manifest_name), 'w') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def clean(directory):
+    try:
+        os.remove(os.path.join(directory, manifest_name))
+    except FileNotFoundError:
+        pass
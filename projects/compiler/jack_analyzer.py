@@ -1,3 +1,5 @@
+from jack_tokenizer import (KEYWORD, SYMBOL, IDENTIFIER, INT_CONST,
+    STRING_CONST, EOF)
 from tree import Node
 
 
@@ -13,7 +15,10 @@ binary_ops = list('+-*/&|<>=')
 
 
 class Analyzer:
-    def __init__(self):
+    # link_parents=False builds a tree without the parent references,
+    # which is enough for the XML output
+    def __init__(self, link_parents=True):
+        self._link_parents = link_parents
         self._token = None
         self._tokens = None
 
@@ -26,8 +31,12 @@ class Analyzer:
             self.terminal = terminal
 
         def _create_node(self, analyzer, name):
+            # the start node comes before the first token
+            token = analyzer._token
             analyzer._cur = Node(analyzer._cur, name,
-                analyzer._token.value if self.terminal else None)
+                token.value if self.terminal else None,
+                analyzer._link_parents,
+                token.lineno if token is not None else None)
             if analyzer._tree is None:
                 analyzer._tree = analyzer._cur
 
@@ -53,7 +62,7 @@ class Analyzer:
         else:
             entry_point()
 
-        if self._token.value != 'EOF':
+        if self._token.type is not EOF:
             raise AnalyzerError('expect EOF')
         # exhaust the generator
         assert next(tokens, None) is None
@@ -78,7 +87,7 @@ class Analyzer:
 
     @_node(terminal=True)
     def identifier(self):
-        assert self._token.type == 'identifier'
+        assert self._token.type is IDENTIFIER
         self._next()
 
     @_node(inline=True)
@@ -132,7 +141,7 @@ class Analyzer:
             if self._token.value in type_names:
                 self.type_name()
                 self.var_name()
-            elif self._token.type == 'identifier':
+            elif self._token.type is IDENTIFIER:
                 self.identifier()
                 self.var_name()
 
@@ -185,11 +194,10 @@ class Analyzer:
     def let_statement(self):
         self._expect('let')
         self.var_name()
-        last_identifier = self._cur.children[-1]
         if self._token.value == '[':
-            self.array_assignment(adopt_child=last_identifier)
+            self.array_assignment(adopt_child=self._cur.pop())
         else:
-            self.assignment(adopt_child=last_identifier)
+            self.assignment(adopt_child=self._cur.pop())
 
     @_node()
     def array_assignment(self, adopt_child):
@@ -220,40 +228,48 @@ class Analyzer:
             self.binary_op()
             self.term()
 
-        if len(self._cur.children) == 3:  # term op term
-            assert self._cur.children[1].name == 'binary_op'
-            self._pivot_node(self._cur.children[1])
+        if len(self._cur.children) > 1:  # term (op term)+
+            self._chain_binary_ops()
 
-    def _pivot_node(self, node):
+    def _chain_binary_ops(self):
+        # no precedence, `a - b + c` is `(a - b) + c`: each operator takes
+        # the previous one as its left operand. Linked top down, so that
+        # every term moves to its final depth once.
         children = self._cur.children
-        self._cur.children = [node]
-        for child in children:
-            if child != node:
-                child.parent = node
-                node.children.append(child)
+        terms = children[0::2]
+        ops = children[1::2]
+        assert all(op.name == 'binary_op' for op in ops)
+
+        self._cur.children = []
+        parent = self._cur
+        for op in reversed(ops):
+            parent.append(op, self._link_parents)
+            parent = op
+        parent.append(terms[0], self._link_parents)
+        for op, term in zip(ops, terms[1:]):
+            op.append(term, self._link_parents)
 
     @_node()
     def term(self):
-        if self._token.type == 'int_const':
+        if self._token.type is INT_CONST:
             self.int_const()
-        elif self._token.type == 'string_const':
+        elif self._token.type is STRING_CONST:
             self.string_const()
         elif self._token.value in constants:
             self.constant()
-        elif self._token.type == 'identifier':
+        elif self._token.type is IDENTIFIER:
             self.identifier()
-            last_identifier = self._cur.children[-1]
             if self._token.value in '.(':
-                self.subroutine_call(adopt_child=last_identifier)
+                self.subroutine_call(adopt_child=self._cur.pop())
             elif self._token.value == '[':
-                self.array_access(adopt_child=last_identifier)
+                self.array_access(adopt_child=self._cur.pop())
         elif self._accept('('):
             self.expression()
             self._expect(')')
         else:
             self.unary_op()
             self.term()
-            self._pivot_node(self._cur.children[0])
+            self._cur.children[0].append(self._cur.pop(), self._link_parents)
 
     @_node()
     def array_access(self, adopt_child=None):
@@ -305,9 +321,8 @@ class Analyzer:
         self._expect(')')
 
     def _adopt_child(self, node):
-        node.parent.remove(node)
-        self._cur.children.append(node)
-        node.parent = self._cur
+        # the node is detached by the caller before the new node is created
+        self._cur.append(node, self._link_parents)
 
     @_node()
     def expression_list(self):
@@ -317,9 +332,9 @@ class Analyzer:
             return (tvalue in constants
                 or tvalue == '('
                 or tvalue in unary_ops
-                or ttype == 'int_const'
-                or ttype == 'string_const'
-                or ttype == 'identifier')
+                or ttype is INT_CONST
+                or ttype is STRING_CONST
+                or ttype is IDENTIFIER)
 
         if is_term():
             self.expression()
@@ -381,6 +396,8 @@ class Analyzer:
     def subroutine_name(self):
         self.identifier()
 
+    # keyword and symbol values are interned by the tokenizer, so `in`
+    # matches them by identity
     def _expect(self, *args):
         if self._token.value not in args:
             raise AnalyzerError('lineno: %s: expect %s'
@@ -394,20 +411,20 @@ class Analyzer:
         return False
 
     def _consume(self):
-        if self._token.type == 'keyword':
+        if self._token.type is KEYWORD:
             self.keyword()
         else:
-            assert self._token.type == 'symbol', self._token.type
+            assert self._token.type is SYMBOL, self._token.type
             self.symbol()
 
     @_node(terminal=True)
     def keyword(self):
-        assert self._token.type == 'keyword', self._token.type
+        assert self._token.type is KEYWORD, self._token.type
         self._next()
 
     @_node(terminal=True)
     def symbol(self):
-        assert self._token.type == 'symbol', self._token.type
+        assert self._token.type is SYMBOL, self._token.type
         self._next()
 
     def _next(self):
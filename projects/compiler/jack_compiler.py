@@ -2,9 +2,13 @@ import collections
 import itertools
 import os
 
-from jack_tokenizer import Tokenizer
-from jack_analyzer import Analyzer, statements
+from jack_tokenizer import (Tokenizer, IDENTIFIER, INT_CONST, STRING_CONST,
+    EOF)
+from jack_analyzer import (Analyzer, AnalyzerError, statements, type_names,
+    constants)
+from jack_optimizer import ExpressionOptimizer
 from tree import Visitor
+from vm_optimizer import PeepholeOptimizer
 
 binary_ops = {
     '+': 'add',
@@ -24,6 +28,14 @@ unary_ops = {
 }
 
 
+class CompilerError(RuntimeError):
+    # the code can not be generated, e.g. an undefined variable; lineno is
+    # the line of the token or of the node being compiled
+    def __init__(self, lineno, message):
+        super().__init__(message)
+        self.lineno = lineno
+
+
 # TODO: empty visitor decorator
 # TODO: class-wide `chained` generator instead fo `generator=True`
 
@@ -31,51 +43,98 @@ unary_ops = {
 class SymbolTable:
     Variable = collections.namedtuple('Variable', ['kind', 'type', 'name', 'no'])
 
+    # a stack of scopes, the class one at the bottom: the inner names
+    # shadow the outer ones and every scope numbers its variables per kind
     def __init__(self):
-        self._data = dict()
+        self._scopes = []
+        self.clear()
 
     def clear(self):
-        self._data.clear()
+        self._scopes[:] = [({}, collections.Counter())]
+
+    def push(self):
+        self._scopes.append(({}, collections.Counter()))
+
+    def pop(self):
+        assert len(self._scopes) > 1
+        self._scopes.pop()
 
     def add(self, kind, typename, name):
-        assert name not in self
-        self._data[name] = self.Variable(
-            kind, typename, name, self.count(kind))
+        data, counts = self._scopes[-1]
+        assert name not in data, f'{name} is already declared'
+        data[name] = self.Variable(kind, typename, name, counts[kind])
+        counts[kind] += 1
 
     def count(self, kind):
-        return sum(v.kind == kind for v in self._data.values())
+        return sum(counts[kind] for _, counts in self._scopes)
 
     def __contains__(self, name):
-        return name in self._data
+        return any(name in data for data, _ in self._scopes)
 
     def __getitem__(self, name):
-        return self._data[name]
+        for data, _ in reversed(self._scopes):
+            if name in data:
+                return data[name]
+        raise KeyError(name)
 
     def __len__(self):
-        return len(self._data)
+        return sum(len(data) for data, _ in self._scopes)
+
+
+Subroutine = collections.namedtuple('Subroutine',
+    ['kind', 'type', 'name', 'nargs'])
+
+
+def subroutine_table(class_dec):
+    # subroutine name -> Subroutine, nargs does not count `this`
+    table = {}
+    for node in class_dec.children:
+        if node.name != 'subroutine_dec':
+            continue
+        kind, return_type, name = (c.value for c in node.children[:3])
+        parameters = node.children[4]
+        assert parameters.name == 'parameter_list'
+        nargs = sum(c.name != 'symbol' for c in parameters.children) // 2
+        table[name] = Subroutine(kind, return_type, name, nargs)
+    return table
 
 
 class CodeGenerator(Visitor):
-    def __init__(self):
+    # `subroutines` maps class names to their subroutine tables and lets
+    # the calls `ClassName.fn()` to the other classes resolve methods
+    def __init__(self, subroutines=None):
         super().__init__(generator=True)
 
+        self._subroutines = dict(subroutines or {})
         self._class_name = None
-        self._global = SymbolTable()
-        self._local = SymbolTable()
+        self._symbols = SymbolTable()
 
         self._function_kind = None
         self._return_type = None
         self._function_name = None
+        # if/while statement -> its number within the function
+        self._label_numbers = {}
+        # the line of the last visited node, for the errors
+        self._lineno = None
+
+    def visit(self, root):
+        if root.lineno is not None:
+            self._lineno = root.lineno
+        return super().visit(root)
 
     def visit_start(self, node, children):
-        assert not self._global
-        yield from children
-        self._global.clear()
+        assert not self._symbols
+        try:
+            yield from children
+        except AssertionError as e:
+            raise CompilerError(self._lineno, str(e) or 'invalid code') from e
+        self._symbols.clear()
 
     def visit_class_dec(self, node, children):
         self._keyword('class', children)
         assert self._class_name is None
         self._class_name = self._identifier(children)
+        self._subroutines[self._class_name] = subroutine_table(node)
 
         yield f'// {self._class_name}'
         yield from children
@@ -89,12 +148,11 @@ class CodeGenerator(Visitor):
 
         for node_name, varname in children:
             assert node_name == 'identifier'
-            self._global.add(kind, typename, varname)
+            self._symbols.add(kind, typename, varname)
         yield from itertools.chain.from_iterable(children)
 
     def visit_subroutine_dec(self, node, children):
         assert self._class_name is not None
-        assert not self._local
         assert self._function_kind is None
         assert self._return_type is None
         assert self._function_name is None
@@ -103,21 +161,22 @@ class CodeGenerator(Visitor):
         self._function_kind = kind
         self._return_type = self._identifier_or_keyword(children)
         self._function_name = self._identifier(children)
+        self._label_numbers.clear()
 
+        self._symbols.push()
         yield from children
-
-        self._local.clear()
+        self._symbols.pop()
         self._function_kind = None
         self._return_type = None
         self._function_name = None
 
     def visit_parameter_list(self, node, children):
         if self._function_kind == 'method':
-            self._local.add('argument', self._class_name, 'this')
+            self._symbols.add('argument', self._class_name, 'this')
         for node_name, typename in children:
             assert node_name in ['keyword', 'identifier']
             varname = self._identifier(children)
-            self._local.add('argument', typename, varname)
+            self._symbols.add('argument', typename, varname)
         yield from children
 
     def visit_var_dec(self, node, children):
@@ -125,12 +184,12 @@ class CodeGenerator(Visitor):
         typename = self._identifier_or_keyword(children)
         for node_name, varname in children:
             assert node_name == 'identifier'
-            self._local.add('local', typename, varname)
+            self._symbols.add('local', typename, varname)
         yield from children
 
     def visit_subroutine_body_statements(self, node, children):
-        n_fields = self._global.count('field')
-        n_locals = self._local.count('local')
+        n_fields = self._symbols.count('field')
+        n_locals = self._symbols.count('local')
 
         yield f'// {self._function_kind}'
         yield f'function {self._class_name}.{self._function_name} {n_locals}'
@@ -161,9 +220,11 @@ class CodeGenerator(Visitor):
         yield from children
 
     def _get_var(self, name):
-        if name in self._local:
-            return self._local[name]
-        return self._global[name]
+        try:
+            return self._symbols[name]
+        except KeyError:
+            raise CompilerError(self._lineno,
+                f'undefined variable: {name}') from None
 
     def _get_segment(self, var):
         if var.kind == 'field':
@@ -213,15 +274,20 @@ class CodeGenerator(Visitor):
             class_or_var_name = self._identifier(children)
             method = self._identifier(children)
 
-        try:
+        if class_or_var_name in self._symbols:
             var = self._get_var(class_or_var_name)
             var_type = var.type
             yield f'push {self._get_segment(var)} {var.no}  // *{class_or_var_name}'
             nargs += 1
-        except KeyError:
+        else:
             # class_or_var_name is a class name
             var_type = class_or_var_name
-            if self._get_function_type(node, method) == 'method':
+            if self._get_function_type(var_type, method) == 'method':
+                # only the methods of this class have `this` to call on
+                if var_type != self._class_name:
+                    raise CompilerError(self._lineno,
+                        f'{var_type}.{method} is a method, call it on an'
+                        ' object')
                 yield f'push pointer 0'
                 nargs += 1
 
@@ -229,21 +295,12 @@ class CodeGenerator(Visitor):
         nargs += self._count_call_args(node)
         yield f'call {var_type}.{method} {nargs}'
 
-    def _get_function_type(self, node, method):
-        class FuncVisitor(Visitor):
-            def visit_subroutine_dec(self, node, children):
-                if node.children[2].value == method:
-                    return node.children[0].value
-                return None
-
-            def default_visit(self, node, children):
-                value = filter(bool, children)
-                return next(value, None)
-
-        root = node
-        while root.parent is not None:
-            root = root.parent
-        return FuncVisitor().visit(root)
+    def _get_function_type(self, class_name, method):
+        # None for the classes compiled separately, e.g. the OS
+        try:
+            return self._subroutines[class_name][method].kind
+        except KeyError:
+            return None
 
     def _this_method_call(self, node):
         tokens = 0
@@ -273,40 +330,53 @@ class CodeGenerator(Visitor):
         yield f'pop pointer 1'
         yield f'push that 0'
 
+    def _new_label(self, node):
+        # the labels are numbered per function, the VM scopes them so
+        number = len(self._label_numbers)
+        self._label_numbers[node] = number
+        return number
+
     def visit_if_statement(self, node, children):
-        yield f'// if-{id(node)}'
+        n = self._new_label(node)
+        yield f'// if-{n}'
         yield from children
-        yield f'label end-if-{id(node)}'
+        yield f'label end-if-{n}'
 
     def visit_if_condition(self, node, children):
+        n = self._label_numbers[node.parent]
         yield from children
-        yield f'if-goto if-{id(node.parent)}'
-        yield f'goto else-{id(node.parent)}'
+        yield f'if-goto if-{n}'
+        yield f'goto else-{n}'
 
     def visit_if_body(self, node, children):
-        yield f'label if-{id(node.parent)}'
+        n = self._label_numbers[node.parent]
+        yield f'label if-{n}'
         yield from children
-        yield f'goto end-if-{id(node.parent)}'
+        yield f'goto end-if-{n}'
 
     def visit_else_body(self, node, children):
-        yield f'label else-{id(node.parent)}'
+        n = self._label_numbers[node.parent]
+        yield f'label else-{n}'
         yield from children
 
     def visit_while_statement(self, node, children):
-        yield f'// while-{id(node)}'
+        n = self._new_label(node)
+        yield f'// while-{n}'
         yield from children
 
     def visit_while_condition(self, node, children):
-        yield f'label while-condition-{id(node.parent)}'
+        n = self._label_numbers[node.parent]
+        yield f'label while-condition-{n}'
         yield from children
-        yield f'if-goto while-begin-{id(node.parent)}'
-        yield f'goto while-end-{id(node.parent)}'
+        yield f'if-goto while-begin-{n}'
+        yield f'goto while-end-{n}'
 
     def visit_while_body(self, node, children):
-        yield f'label while-begin-{id(node.parent)}'
+        n = self._label_numbers[node.parent]
+        yield f'label while-begin-{n}'
         yield from children
-        yield f'goto while-condition-{id(node.parent)}'
-        yield f'label while-end-{id(node.parent)}'
+        yield f'goto while-condition-{n}'
+        yield f'label while-end-{n}'
 
     def visit_term(self, node, children):
         if len(node.children) > 1:
@@ -320,6 +390,10 @@ class CodeGenerator(Visitor):
             yield 'neg'
         elif node.children[0].value == 'false':
             yield 'push constant 0'
+        elif node.children[0].value == -32768:
+            # folded, the constant does not fit into 15 bits
+            yield 'push constant 32767'
+            yield 'not'
         elif node.children[0].name == 'int_const':
             yield f'push constant {abs(node.children[0].value)}'
             if node.children[0].value < 0:
@@ -351,11 +425,11 @@ class CodeGenerator(Visitor):
         expression = list(children)
         yield '// return'
         if expression:
-            assert self._return_type != 'void'
+            assert self._return_type != 'void', 'a void function returns a value'
             yield from expression
             yield 'return'
         else:
-            assert self._return_type == 'void'
+            assert self._return_type == 'void', 'expect a return value'
             yield 'push constant 0'
             yield 'return'
 
@@ -384,19 +458,459 @@ class CodeGenerator(Visitor):
         return value
 
 
+def scan_subroutines(tokens):
+    # the same table as subroutine_table() from the tokens of a class
+    table = {}
+    depth = 0
+    tokens = iter(tokens)
+    for token in tokens:
+        if token.value == '{':
+            depth += 1
+        elif token.value == '}':
+            depth -= 1
+        elif depth == 1 and token.value in ('constructor', 'function', 'method'):
+            kind = token.value
+            return_type = next(tokens).value
+            name = next(tokens).value
+            next(tokens)  # (
+            parameters = 0
+            for token in tokens:
+                if token.value == ')':
+                    break
+                if token.value != ',':
+                    parameters += 1
+            table[name] = Subroutine(kind, return_type, name, parameters // 2)
+    return table
+
+
+class StreamingCodeGenerator:
+    # emits the code while parsing, without building the tree: the same
+    # grammar as Analyzer and the same output as CodeGenerator. A call may
+    # precede the declaration of the subroutine, so the subroutine table of
+    # the class comes from a scan of its tokens first: an earlier pass over
+    # the source (class_subroutines), else the tokens are buffered for it.
+    def __init__(self, subroutines=None):
+        self._subroutines = dict(subroutines or {})
+        self._symbols = SymbolTable()
+        self._token = None
+        self._tokens = None
+        # the line of the last consumed token, for the errors
+        self._lineno = None
+
+        self._class_name = None
+        self._function_kind = None
+        self._return_type = None
+        self._function_name = None
+        self._labels = 0
+
+    def generate(self, tokens, class_subroutines=None):
+        if class_subroutines is None:
+            tokens = list(tokens)
+            class_subroutines = scan_subroutines(tokens)
+        self._tokens = iter(tokens)
+        self._next()
+
+        try:
+            yield from self._class_dec(class_subroutines)
+        except AssertionError as e:
+            raise CompilerError(self._lineno, str(e) or 'invalid code') from e
+        if self._token.type is not EOF:
+            raise AnalyzerError('expect EOF')
+        self._symbols.clear()
+
+    def _class_dec(self, class_subroutines):
+        self._expect('class')
+        self._class_name = self._identifier()
+        self._subroutines[self._class_name] = class_subroutines
+
+        yield f'// {self._class_name}'
+        self._expect('{')
+        while self._token.value in ('static', 'field'):
+            self._class_var_dec()
+        while self._token.value in ('constructor', 'function', 'method'):
+            yield from self._subroutine_dec()
+        self._expect('}')
+        yield f'// ~{self._class_name}'
+
+        self._class_name = None
+
+    def _class_var_dec(self):
+        kind = self._token.value
+        self._next()
+        typename = self._type_name()
+        self._symbols.add(kind, typename, self._identifier())
+        while self._accept(','):
+            self._symbols.add(kind, typename, self._identifier())
+        self._expect(';')
+
+    def _subroutine_dec(self):
+        self._function_kind = self._token.value
+        self._next()
+        if self._accept('void'):
+            self._return_type = 'void'
+        else:
+            self._return_type = self._type_name()
+        self._function_name = self._identifier()
+        self._labels = 0
+
+        self._symbols.push()
+        self._expect('(')
+        self._parameter_list()
+        self._expect(')')
+
+        self._expect('{')
+        while self._accept('var'):
+            typename = self._type_name()
+            self._symbols.add('local', typename, self._identifier())
+            while self._accept(','):
+                self._symbols.add('local', typename, self._identifier())
+            self._expect(';')
+
+        n_fields = self._symbols.count('field')
+        n_locals = self._symbols.count('local')
+
+        yield f'// {self._function_kind}'
+        yield f'function {self._class_name}.{self._function_name} {n_locals}'
+        if self._function_kind == 'constructor':
+            yield f'push constant {max(1, n_fields)}  // sizeof({self._class_name})'
+            yield f'call Memory.alloc 1'
+            yield f'pop pointer 0'
+        elif self._function_kind == 'method':
+            yield f'push argument 0  // this'
+            yield f'pop pointer 0'
+
+        yield from self._statements()
+        self._expect('}')
+        self._symbols.pop()
+
+        self._function_kind = None
+        self._return_type = None
+        self._function_name = None
+
+    def _parameter_list(self):
+        if self._function_kind == 'method':
+            self._symbols.add('argument', self._class_name, 'this')
+
+        def accept_parameter():
+            if (self._token.value in type_names
+                    or self._token.type is IDENTIFIER):
+                typename = self._token.value
+                self._next()
+                self._symbols.add('argument', typename, self._identifier())
+
+        accept_parameter()
+        while self._accept(','):
+            accept_parameter()
+
+    def _statements(self):
+        while self._token.value in statements:
+            statement = self._token.value
+            self._next()
+            if statement == 'let':
+                yield from self._let_statement()
+            elif statement == 'do':
+                yield from self._do_statement()
+            elif statement == 'if':
+                yield from self._if_statement()
+            elif statement == 'while':
+                yield from self._while_statement()
+            else:
+                yield from self._return_statement()
+
+    def _let_statement(self):
+        yield f'// let'
+        var = self._get_var(self._identifier())
+        if self._accept('['):
+            yield f'push {self._get_segment(var)} {var.no}  // {var.name}'
+            yield from self._expression()
+            yield 'add  // *arr + index'
+            self._expect(']')
+            self._expect('=')
+            yield from self._expression()
+            self._expect(';')
+            yield 'pop temp 0'
+            yield 'pop pointer 1'
+            yield 'push temp 0'
+            yield 'pop that 0'
+        else:
+            self._expect('=')
+            yield from self._expression()
+            self._expect(';')
+            yield f'pop {self._get_segment(var)} {var.no}  // {var.name}'
+        yield f'// ~let'
+
+    def _do_statement(self):
+        yield f'// do'
+        yield from self._subroutine_call(self._identifier())
+        self._expect(';')
+        yield f'pop temp 0  // ignore returned value'
+        yield f'// ~do'
+
+    def _if_statement(self):
+        n = self._labels
+        self._labels += 1
+
+        yield f'// if-{n}'
+        self._expect('(')
+        yield from self._expression()
+        self._expect(')')
+        yield f'if-goto if-{n}'
+        yield f'goto else-{n}'
+
+        self._expect('{')
+        yield f'label if-{n}'
+        yield from self._statements()
+        self._expect('}')
+        yield f'goto end-if-{n}'
+
+        yield f'label else-{n}'
+        if self._accept('else'):
+            self._expect('{')
+            yield from self._statements()
+            self._expect('}')
+        yield f'label end-if-{n}'
+
+    def _while_statement(self):
+        n = self._labels
+        self._labels += 1
+
+        yield f'// while-{n}'
+        yield f'label while-condition-{n}'
+        self._expect('(')
+        yield from self._expression()
+        self._expect(')')
+        yield f'if-goto while-begin-{n}'
+        yield f'goto while-end-{n}'
+
+        self._expect('{')
+        yield f'label while-begin-{n}'
+        yield from self._statements()
+        self._expect('}')
+        yield f'goto while-condition-{n}'
+        yield f'label while-end-{n}'
+
+    def _return_statement(self):
+        yield '// return'
+        if self._accept(';'):
+            assert self._return_type == 'void', 'expect a return value'
+            yield 'push constant 0'
+        else:
+            assert self._return_type != 'void', 'a void function returns a value'
+            yield from self._expression()
+            self._expect(';')
+        yield 'return'
+
+    def _expression(self):
+        yield from self._term()
+        while self._token.value in binary_ops:
+            op = self._token.value
+            self._next()
+            yield from self._term()
+            yield binary_ops[op]
+
+    def _term(self):
+        token = self._token
+        if token.type is INT_CONST:
+            self._next()
+            yield f'push constant {abs(token.value)}'
+            if token.value < 0:
+                yield 'neg'
+        elif token.type is STRING_CONST:
+            self._next()
+            yield f'push constant {len(token.value[1:-1])}'
+            yield f'call String.new 1'
+            for ch in token.value[1:-1]:  # without the surrounding quotes
+                yield f'push constant {ord(ch)}'
+                yield f'call String.appendChar 2'
+        elif token.value in constants:
+            self._next()
+            if token.value == 'this':
+                yield 'push pointer 0  // this'
+            elif token.value == 'null':
+                yield 'push constant 0  // null'
+            elif token.value == 'true':
+                yield 'push constant 1'
+                yield 'neg'
+            else:
+                yield 'push constant 0'
+        elif token.type is IDENTIFIER:
+            self._next()
+            if self._token.value in ('.', '('):
+                yield from self._subroutine_call(token.value)
+            elif self._accept('['):
+                var = self._get_var(token.value)
+                yield f'push {self._get_segment(var)} {var.no}  // *{var.name}'
+                yield from self._expression()
+                self._expect(']')
+                yield f'add  // *{var.name}[expr]'
+                yield f'pop pointer 1'
+                yield f'push that 0'
+            else:
+                var = self._get_var(token.value)
+                yield f'push {self._get_segment(var)} {var.no}  // {var.name}'
+        elif self._accept('('):
+            yield from self._expression()
+            self._expect(')')
+        else:
+            op = self._token.value
+            self._expect(*unary_ops)
+            yield from self._term()
+            yield unary_ops[op]
+
+    def _subroutine_call(self, name):
+        if self._accept('.'):
+            # <class_or_var_name>.<fn>(...)
+            class_or_var_name = name
+            method = self._identifier()
+        else:
+            # <fn>(...)
+            class_or_var_name = self._class_name
+            method = name
+
+        nargs = 0
+        if class_or_var_name in self._symbols:
+            var = self._get_var(class_or_var_name)
+            var_type = var.type
+            yield f'push {self._get_segment(var)} {var.no}  // *{class_or_var_name}'
+            nargs += 1
+        else:
+            # class_or_var_name is a class name
+            var_type = class_or_var_name
+            if self._get_function_type(var_type, method) == 'method':
+                # only the methods of this class have `this` to call on
+                if var_type != self._class_name:
+                    raise CompilerError(self._lineno,
+                        f'{var_type}.{method} is a method, call it on an'
+                        ' object')
+                yield f'push pointer 0'
+                nargs += 1
+
+        self._expect('(')
+        nargs += yield from self._expression_list()
+        self._expect(')')
+        yield f'call {var_type}.{method} {nargs}'
+
+    def _expression_list(self):
+        token = self._token
+        if not (token.value in constants
+                or token.value == '('
+                or token.value in unary_ops
+                or token.type in (INT_CONST, STRING_CONST, IDENTIFIER)):
+            return 0
+
+        yield from self._expression()
+        nargs = 1
+        while self._accept(','):
+            yield from self._expression()
+            nargs += 1
+        return nargs
+
+    _get_var = CodeGenerator._get_var
+    _get_segment = CodeGenerator._get_segment
+    _get_function_type = CodeGenerator._get_function_type
+
+    def _type_name(self):
+        if self._token.value in type_names:
+            typename = self._token.value
+            self._next()
+            return typename
+        return self._identifier()
+
+    def _identifier(self):
+        if self._token.type is not IDENTIFIER:
+            raise AnalyzerError('lineno: %s: expect an identifier'
+                % self._token.lineno)
+        name = self._token.value
+        self._next()
+        return name
+
+    def _expect(self, *args):
+        if self._token.value not in args:
+            raise AnalyzerError('lineno: %s: expect %s'
+                % (self._token.lineno, args))
+        self._next()
+
+    def _accept(self, *args):
+        if self._token.value in args:
+            self._next()
+            return True
+        return False
+
+    def _next(self):
+        if self._token is not None:
+            self._lineno = self._token.lineno
+        try:
+            self._token = next(self._tokens)
+        except StopIteration:
+            raise AnalyzerError('unexpected end of file')
+
+
 class Compiler:
+    # `visitor` builds the tree with Analyzer and runs CodeGenerator over it,
+    # `streaming` generates the same code while parsing
+    engines = ('visitor', 'streaming')
+    # 0: the code as generated, 1: rewritten by the peephole optimizer,
+    # 2: also with the expressions of the tree folded and strength reduced
+    levels = (0, 1, 2)
+
+    def __init__(self, subroutines=None, engine='visitor', optimize=0):
+        if engine not in self.engines:
+            raise ValueError(f'unknown engine: {engine}')
+        if optimize not in self.levels:
+            raise ValueError(f'unknown optimization level: {optimize}')
+        if optimize >= 2 and engine == 'streaming':
+            raise ValueError('the streaming engine has no tree to optimize')
+        self.subroutines = subroutines
+        self.engine = engine
+        self.optimize = optimize
+        # the hits of the optimizer rules over all the compiled files
+        self.stats = collections.Counter()
+
+    def subroutine_table(self, path):
+        tree = Analyzer(link_parents=False).start(Tokenizer().tokenize(path))
+        class_dec, = tree.children
+        return class_dec.children[1].value, subroutine_table(class_dec)
+
+    def _scan_subroutines(self, path):
+        # the subroutine table of the class from a first pass over its
+        # tokens, None when the source can not be read twice
+        if isinstance(path, str):
+            return scan_subroutines(Tokenizer().tokenize(path))
+        if not path.seekable():
+            return None
+        start = path.tell()
+        table = scan_subroutines(Tokenizer().tokenize(path))
+        path.seek(start)
+        return table
+
     def compile(self, path, output_file=None):
         tokenizer = Tokenizer()
         tokens = tokenizer.tokenize(path)
 
-        analyzer = Analyzer()
-        tree = analyzer.start(tokens)
-
-        cg = CodeGenerator()
-        code = cg.visit(tree)
+        if self.engine == 'streaming':
+            cg = StreamingCodeGenerator(self.subroutines)
+            code = cg.generate(tokens, self._scan_subroutines(path))
+        else:
+            analyzer = Analyzer()
+            tree = analyzer.start(tokens)
+            if self.optimize >= 2:
+                ExpressionOptimizer(self.stats).optimize(tree)
+
+            cg = CodeGenerator(self.subroutines)
+            code = cg.visit(tree)
+        if self.optimize >= 1:
+            code = PeepholeOptimizer(self.stats).optimize(code)
         if output_file is not None:
-            with open(output_file, 'wt') as f:
-                for cmd in code:
-                    f.write('%s\n' % cmd)
+            # write next to the target and rename, so a failed compilation
+            # never leaves a truncated .vm behind
+            tmp_file = '%s.%s.tmp' % (output_file, os.getpid())
+            try:
+                with open(tmp_file, 'wt') as f:
+                    for cmd in code:
+                        f.write('%s\n' % cmd)
+                os.replace(tmp_file, output_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
         else:
             return code
@@ -0,0 +1,163 @@
+import collections
+
+from tree import Node
+from vm_os import to_int16
+
+# x * c with |c| up to this turns into x + x + ... + x, each operand is a
+# push, still far cheaper than a call of Math.multiply
+max_add_chain = 4
+
+constant_values = {'true': -1, 'false': 0, 'null': 0}
+
+
+def _divide(x, y):
+    # Math.divide rounds toward zero; the division by zero is left for
+    # the runtime to report, as is the overflow of -32768
+    if y == 0 or -32768 in (x, y):
+        return None
+    q = abs(x) // abs(y)
+    return q if (x < 0) == (y < 0) else -q
+
+
+binary_ops = {
+    '+': lambda x, y: x + y,
+    '-': lambda x, y: x - y,
+    '*': lambda x, y: x * y,
+    '/': _divide,
+    '&': lambda x, y: x & y,
+    '|': lambda x, y: x | y,
+    '<': lambda x, y: -(x < y),
+    '>': lambda x, y: -(x > y),
+    '=': lambda x, y: -(x == y),
+}
+
+unary_ops = {
+    '-': lambda x: -x,
+    '~': lambda x: ~x,
+}
+
+
+class ExpressionOptimizer:
+    # rewrites the expressions of a syntax tree in place: folds the
+    # constant subexpressions with the 16 bit semantics of the Jack VM and
+    # replaces the multiplications of a variable by a small constant with
+    # additions; `stats` counts the rewrites
+    def __init__(self, stats=None):
+        self.stats = collections.Counter() if stats is None else stats
+
+    def optimize(self, tree):
+        self._visit(tree)
+        return tree
+
+    def _visit(self, node):
+        # bottom up, returns the node to put in the place of `node`
+        for child in list(node.children):
+            new = self._visit(child)
+            if new is not child:
+                node.replace(child, new)
+
+        if node.name == 'binary_op':
+            return self._binary_op(node)
+        if node.name == 'term':
+            return self._term(node)
+        return node
+
+    def _value(self, node):
+        # the value of a constant term, None otherwise
+        if node.name != 'term' or len(node.children) != 1:
+            return None
+        child, = node.children
+        if child.name == 'int_const':
+            return child.value
+        if child.name == 'keyword':
+            return constant_values.get(child.value)
+        return None
+
+    def _variable(self, node):
+        # a term reading a variable, it can be evaluated any number of times
+        return (node.name == 'term' and len(node.children) == 1
+            and node.children[0].name == 'identifier')
+
+    def _term(self, node):
+        children = node.children
+        if len(children) == 3 and children[1].name == 'expression':
+            # ( constant )
+            inner, = children[1].children
+            value = self._value(inner)
+            if value is not None:
+                return self._constant(value)
+        elif len(children) == 1 and children[0].name == 'unary_op':
+            symbol, operand = children[0].children
+            value = self._value(operand)
+            if value is not None:
+                value = unary_ops[symbol.value](value)
+                self.stats['constant-fold'] += 1
+                return self._constant(to_int16(value))
+        return node
+
+    def _binary_op(self, node):
+        symbol, left, right = node.children
+        op = symbol.value
+        x, y = self._value(left), self._value(right)
+
+        if x is not None and y is not None:
+            value = binary_ops[op](x, y)
+            if value is not None:
+                self.stats['constant-fold'] += 1
+                return self._constant(to_int16(value))
+            return node
+
+        if op == '*':
+            if x is not None:
+                x, y, left, right = y, x, right, left
+            if y is None:
+                return node
+            if y == 1:
+                self.stats['identity'] += 1
+                return left
+            if self._variable(left) and abs(y) <= max_add_chain:
+                self.stats['multiply-chain'] += 1
+                return self._add_chain(left, y)
+        elif ((op == '+' and x == 0) or
+                (op in ('+', '-') and y == 0) or (op == '/' and y == 1)):
+            self.stats['identity'] += 1
+            return right if x == 0 else left
+        return node
+
+    def _add_chain(self, variable, n):
+        if n == 0:
+            return self._constant(0)
+        chain = variable
+        for _ in range(abs(n) - 1):
+            op = Node(None, 'binary_op', None)
+            Node(op, 'symbol', '+')
+            op.append(chain)
+            op.append(self._copy(variable))
+            chain = op
+        if n < 0:
+            term = Node(None, 'term', None)
+            unary_op = Node(term, 'unary_op', None)
+            Node(unary_op, 'symbol', '-')
+            unary_op.append(self._parenthesize(chain))
+            chain = term
+        return chain
+
+    def _parenthesize(self, node):
+        if node.name == 'term':
+            return node
+        term = Node(None, 'term', None)
+        Node(term, 'symbol', '(')
+        Node(term, 'expression', None).append(node)
+        Node(term, 'symbol', ')')
+        return term
+
+    def _copy(self, node):
+        copy = Node(None, node.name, node.value, lineno=node.lineno)
+        for child in node.children:
+            copy.append(self._copy(child))
+        return copy
+
+    def _constant(self, value):
+        term = Node(None, 'term', None)
+        Node(term, 'int_const', value)
+        return term
@@ -79,7 +79,7 @@ class Parser:
 
         tokens = write_tokens(tokens, tokenizer_ouput)
 
-        analyzer = Analyzer()
+        analyzer = Analyzer(link_parents=False)
         tree = analyzer.start(tokens)
 
         with open(analyzer_ouput, 'w') as f:
@@ -1,4 +1,6 @@
+import re
 import string
+import sys
 
 
 symbols = set('{}()[].,;+-*/&|<>=~')
@@ -8,8 +10,52 @@ keywords = {'class', 'constructor', 'function', 'method',
     'true', 'false', 'null', 'this', 'let', 'do', 'if', 'else',
     'while', 'return'}
 
+# token kinds; the strings double as the XML tags of jack_parser
+KEYWORD = sys.intern('keyword')
+SYMBOL = sys.intern('symbol')
+IDENTIFIER = sys.intern('identifier')
+INT_CONST = sys.intern('int_const')
+STRING_CONST = sys.intern('string_const')
+EOF = sys.intern('EOF')
+
+# keyword and symbol values are shared by all the tokens, so the analyzer
+# compares them by identity; the regex engine interns identifiers as well
+_interned = {value: sys.intern(value) for value in keywords | symbols}
+
+_symbols = re.escape(''.join(sorted(symbols)))
+
+# one lexeme after the spaces of its line, one group per kind of lexeme:
+# the tokenizer dispatches on the index of the group that matched
+_lexeme = re.compile(r'''
+    [%(space)s]*
+    (?:
+        (?P<newline>\n)
+      | (?P<comment>//[^\n]*|/\*.*?\*/)
+      | (?P<unterminated_comment>/\*)
+      | (?P<symbol>[%(symbols)s])
+      | (?P<word>[^%(spaces)s%(symbols)s"]+)
+      | (?P<string_const>"[^"\n]*")
+      | (?P<malformed_string>"[^"\n]*)
+    )
+''' % dict(space=re.escape(string.whitespace.replace('\n', '')),
+    spaces=re.escape(string.whitespace), symbols=_symbols), re.S | re.X)
+
+_NEWLINE = _lexeme.groupindex['newline']
+_COMMENT = _lexeme.groupindex['comment']
+_SYMBOL = _lexeme.groupindex['symbol']
+_WORD = _lexeme.groupindex['word']
+_STRING_CONST = _lexeme.groupindex['string_const']
+_MALFORMED_STRING = _lexeme.groupindex['malformed_string']
+
+_symbol_values = {symbol: _interned[symbol] for symbol in symbols}
+# word -> (kind, value) of the keywords, the tokenizer adds the identifiers
+# and integers it meets
+_words = {keyword: (KEYWORD, _interned[keyword]) for keyword in keywords}
+
 
 class Token:
+    __slots__ = ('lineno', 'type', 'value')
+
     def __init__(self, lineno, tokentype, value):
         self.lineno = lineno
         self.type = tokentype
@@ -24,6 +70,16 @@ class TokenizerError(RuntimeError):
 
 
 class Tokenizer:
+    # `regex` scans the whole source with a single regular expression,
+    # `char` is the original character by character state machine
+    engines = ('regex', 'char')
+
+    def __init__(self, engine='regex'):
+        if engine not in self.engines:
+            raise ValueError(f'unknown engine: {engine}')
+        self.engine = engine
+        self._tokenize = getattr(self, '_tokenize_' + engine)
+
     def tokenize(self, fobj_or_path):
         if isinstance(fobj_or_path, str):
             with open(fobj_or_path) as f:
@@ -32,7 +88,45 @@ class Tokenizer:
             yield from self._tokenize(fobj_or_path)
 
 
-    def _tokenize(self, fobj):
+    def _tokenize_regex(self, fobj):
+        lineno = 1
+        words = dict(_words)
+        get_word = words.get
+        symbol_values = _symbol_values
+        # the group indices as locals, the most frequent kinds come first
+        symbol, word, newline, comment, string_const = (_SYMBOL, _WORD,
+            _NEWLINE, _COMMENT, _STRING_CONST)
+        for m in _lexeme.finditer(fobj.read()):
+            i = m.lastindex
+            if i == symbol:
+                yield Token(lineno, SYMBOL, symbol_values[m[i]])
+            elif i == word:
+                lexeme = m[i]
+                kind = get_word(lexeme)
+                if kind is None:
+                    if lexeme[0] in string.digits:
+                        value = self._make_token(lineno, lexeme).value
+                        kind = words[lexeme] = (INT_CONST, value)
+                    else:
+                        kind = words[lexeme] = (IDENTIFIER,
+                            sys.intern(lexeme))
+                tokentype, value = kind
+                yield Token(lineno, tokentype, value)
+            elif i == newline:
+                lineno += 1
+            elif i == comment:
+                lineno += m[i].count('\n')
+            elif i == string_const:
+                yield Token(lineno, STRING_CONST, m[i])
+            elif i == _MALFORMED_STRING:
+                raise TokenizerError('malformed string: lineno %s' % lineno)
+            else:
+                raise TokenizerError(
+                    'unterminated comment: lineno %s' % lineno)
+        yield self._make_token(None, '')
+
+
+    def _tokenize_char(self, fobj):
         token = []
 
         def make_token(lineno):
@@ -65,7 +159,8 @@ class Tokenizer:
                 token.append(ch)
             elif token[:2] == ['/', '*']:
                 token.append(ch)
-                if token[-2:] == ['*', '/']:
+                # the '*' of '/*/' does not close the comment
+                if len(token) > 3 and token[-2:] == ['*', '/']:
                     ignore_token()
 
             #
@@ -115,27 +210,27 @@ class Tokenizer:
     def _make_token(self, lineno, token):
         if lineno is None:
             assert not token
-            return Token(None, 'EOF', 'EOF')
+            return Token(None, EOF, EOF)
         assert token
 
         if len(token) == 1 and token[0] in symbols:
-            return Token(lineno, 'symbol', token)
+            return Token(lineno, SYMBOL, _interned[token])
 
         if token[0] in string.digits:
             try:
-                return Token(lineno, 'int_const', int(token))
+                return Token(lineno, INT_CONST, int(token))
             except ValueError:
                 raise TokenizerError('not an integer: lineno %s' % lineno)
 
         if token[0] == '"' or token[-1] == '"':
             if token[0] != token[-1] or len(token) == 1:
                 raise TokenizerError('malformed string: lineno %s' % lineno)
-            return Token(lineno, 'string_const', token)
+            return Token(lineno, STRING_CONST, token)
 
         if token in keywords:
-            return Token(lineno, 'keyword', token)
+            return Token(lineno, KEYWORD, _interned[token])
 
-        return Token(lineno, 'identifier', token)
+        return Token(lineno, IDENTIFIER, token)
 
 
     def _read(self, fobj):
@@ -0,0 +1,51 @@
+import pytest
+
+import build_cache
+from jack_compiler import Compiler
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'Main.jack'
+    path.write_text('''
+        class Main {
+            function int fn() {
+                return 1;
+            }
+        }
+    ''')
+    return path
+
+
+def build(source, options=()):
+    cache = build_cache.BuildCache(options)
+    output_file = source.with_suffix('.vm')
+    key = cache.lookup(str(source), str(output_file))
+    if key is not None:
+        Compiler().compile(str(source), str(output_file))
+        cache.store(str(source), key, str(output_file))
+    cache.save()
+    return cache.hits, cache.misses
+
+
+def test_unchanged_source_is_a_hit(source):
+    assert build(source) == (0, 1)
+    assert build(source) == (1, 0)
+
+
+def test_changes_are_misses(source):
+    build(source)
+    source.write_text(source.read_text().replace('return 1', 'return 2'))
+    assert build(source) == (0, 1)
+    assert build(source, ['-O1']) == (0, 1)
+
+    source.with_suffix('.vm').write_text('')
+    assert build(source) == (0, 1)
+    assert 'push constant 2' in source.with_suffix('.vm').read_text()
+
+
+def test_clean(source):
+    build(source)
+    build_cache.clean(str(source.parent))
+    assert not (source.parent / build_cache.manifest_name).exists()
+    assert build(source) == (0, 1)
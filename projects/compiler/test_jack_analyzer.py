@@ -391,3 +391,40 @@ def test_start():
     a = jack_analyzer.Analyzer()
     tree = a.start(tokens)
     assert tree.name == 'start'
+
+
+def walk(root, depth=0, parent=None):
+    yield root, depth, parent
+    for child in root.children:
+        yield from walk(child, depth + 1, root)
+
+
+@pytest.mark.parametrize('link_parents', [True, False])
+def test_tree_links(link_parents):
+    tokens = gen_tokens('''
+            class Foo {
+                function int fn(int x) {
+                    let x[1] = -x + Foo.g(x[2] * 3) - 4 / x;
+                    return x;
+                }
+            }
+        ''')
+    a = jack_analyzer.Analyzer(link_parents=link_parents)
+    tree = a.start(tokens)
+
+    for node, depth, parent in walk(tree):
+        assert node.depth == depth
+        assert node.parent is (parent if link_parents else None)
+
+
+def test_chained_binary_ops():
+    tokens = gen_tokens('a - b + c')
+    a = jack_analyzer.Analyzer()
+    tree = a.start(tokens, entry_point=a.expression)
+
+    expression, = tree.children
+    plus, = expression.children
+    symbol, minus, c = plus.children
+    assert symbol.value == '+'
+    assert [n.name for n in minus.children] == ['symbol', 'term', 'term']
+    assert c.children[0].value == 'c'
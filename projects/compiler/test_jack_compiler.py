@@ -1,8 +1,13 @@
+import glob
 import io
+import os
 import pytest
 
 from vm_emulator import VMEmulator
-from jack_compiler import Compiler
+from jack_compiler import (CodeGenerator, Compiler, CompilerError,
+    StreamingCodeGenerator, Subroutine, SymbolTable, scan_subroutines)
+from JackCompiler import check_file, compile_file, subroutine_tables
+from jack_tokenizer import Tokenizer
 
 
 @pytest.fixture
@@ -53,8 +58,8 @@ def test_do_statement(vm):
         'call Main.run 0',
     ])
 
-    assert vm.memory['static'][0] == 2  # _member_fn_calls
-    assert vm.memory['static'][1] == 1  # _static_fn_calls
+    assert vm.memory['static']['Main', 0] == 2  # _member_fn_calls
+    assert vm.memory['static']['Main', 1] == 1  # _static_fn_calls
     assert vm.stack == [0]
 
 
@@ -217,3 +222,278 @@ def test_parenthesized_expression(vm):
     ])
 
     assert vm.stack == [30]
+
+
+def test_failed_compilation_leaves_no_output(tmp_path):
+    source = tmp_path / 'Main.jack'
+    source.write_text('class Main { function void f() { let x = ; } }')
+    output_file = tmp_path / 'Main.vm'
+
+    with pytest.raises(RuntimeError):
+        Compiler().compile(str(source), str(output_file))
+    assert list(tmp_path.iterdir()) == [source]
+
+
+@pytest.mark.parametrize('engine', Compiler.engines)
+@pytest.mark.parametrize('body, lineno, message', [
+    ('var int x;\n let x = 1;\n let y = x;\n return;', 5,
+        'undefined variable: y'),
+    ('var int x;\n let x = y[0];\n return;', 4, 'undefined variable: y'),
+    ('var int x, x;\n return;', 3, 'x is already declared'),
+    ('\n return 1;', 4, 'a void function returns a value'),
+])
+def test_compiler_error_lineno(engine, body, lineno, message):
+    source = 'class Main {\n function void f() {\n %s\n }\n}' % body
+    with pytest.raises(CompilerError) as e:
+        list(Compiler(engine=engine).compile(io.StringIO(source)))
+    assert e.value.lineno == lineno
+    assert str(e.value) == message
+
+
+def test_compile_file_reports_the_line(tmp_path):
+    source = tmp_path / 'Main.jack'
+    source.write_text('class Main {\n function void f() {\n'
+        ' let x = 0;\n return;\n }\n}\n')
+
+    error, _ = compile_file(str(source), str(tmp_path / 'Main.vm'))
+    assert error.startswith(f'{source}:3: CompilerError: ')
+    assert 'undefined variable: x' in error
+
+
+def test_chained_binary_ops(vm):
+    c = Compiler()
+    vm.load(c.compile(io.StringIO('''
+        class Main {
+            function int fn(int x) {
+                return 1 + x * 3 - 10 / 2;
+            }
+        }
+    ''')))
+
+    vm.execute([
+        'push constant 4',
+        'call Main.fn 1',
+    ])
+
+    # no precedence, ((1 + 4) * 3 - 10) / 2
+    assert vm.stack == [2]
+
+
+def test_subroutine_table():
+    c = Compiler()
+    name, table = c.subroutine_table(io.StringIO('''
+        class Point {
+            constructor Point new(int x, int y) { return this; }
+            method int getX() { return 0; }
+            function void print(Point p, boolean nl, char ch) { return; }
+        }
+    '''))
+
+    assert name == 'Point'
+    assert table == {
+        'new': Subroutine('constructor', 'Point', 'new', 2),
+        'getX': Subroutine('method', 'int', 'getX', 0),
+        'print': Subroutine('function', 'void', 'print', 3),
+    }
+
+
+def test_cross_class_subroutines():
+    source = '''
+        class Main {
+            method void run() {
+                do Other.fn();
+                return;
+            }
+        }
+    '''
+    other = {'Other': {'fn': Subroutine('method', 'void', 'fn', 0)}}
+
+    code = list(Compiler().compile(io.StringIO(source)))
+    assert 'push pointer 0' not in code
+    # Main's `this` is not an Other
+    for engine in Compiler.engines:
+        with pytest.raises(CompilerError) as e:
+            list(Compiler(other, engine).compile(io.StringIO(source)))
+        assert e.value.lineno == 4
+        assert str(e.value) == 'Other.fn is a method, call it on an object'
+
+
+def test_subroutine_tables_report_errors(tmp_path):
+    good = tmp_path / 'Main.jack'
+    good.write_text('class Main {\n function void f() { return; }\n}\n')
+    bad = tmp_path / 'Other.jack'
+    bad.write_text('class Other {\n function void f( { return; }\n}\n')
+
+    tables, errors = subroutine_tables([str(good), str(bad)])
+    assert list(tables) == ['Main']
+    error, = errors
+    assert error.startswith(f'{bad}: AnalyzerError: lineno: 2: ')
+
+
+def test_symbol_table_scopes():
+    symbols = SymbolTable()
+    symbols.add('field', 'int', 'x')
+    symbols.add('static', 'int', 'count')
+    symbols.add('field', 'int', 'y')
+
+    symbols.push()
+    symbols.add('argument', 'int', 'x')
+    symbols.add('local', 'int', 'i')
+    assert symbols['x'] == SymbolTable.Variable('argument', 'int', 'x', 0)
+    assert symbols['y'] == SymbolTable.Variable('field', 'int', 'y', 1)
+    assert symbols.count('field') == 2
+    assert symbols.count('local') == 1
+    assert len(symbols) == 5
+
+    symbols.pop()
+    assert symbols['x'] == SymbolTable.Variable('field', 'int', 'x', 0)
+    assert 'i' not in symbols
+    assert symbols.count('local') == 0
+
+
+def test_engines_agree():
+    root = os.path.join(os.path.dirname(__file__), '..', '..')
+    sources = glob.glob(os.path.join(root, 'projects', '*', '*.jack'))
+    sources += glob.glob(os.path.join(root, 'projects', '*', '*', '*.jack'))
+    assert sources
+
+    for path in sources:
+        visitor = list(Compiler(engine='visitor').compile(path))
+        streaming = list(Compiler(engine='streaming').compile(path))
+        assert visitor == streaming, path
+
+
+def test_streaming_engine_reads_ahead_one_token():
+    source = '''
+        class Main {
+            function int f() { return Main.g(); }
+            function int g() { return 1; }
+        }
+    '''
+    read = []
+    def tokens():
+        for token in Tokenizer().tokenize(io.StringIO(source)):
+            read.append(token.value)
+            yield token
+
+    table = scan_subroutines(Tokenizer().tokenize(io.StringIO(source)))
+    code = StreamingCodeGenerator().generate(tokens(), table)
+    assert next(code) == '// Main'
+    assert read == ['class', 'Main', '{']
+    assert 'call Main.g 0' in code
+
+
+def test_streaming_engine_without_seek():
+    # the tokens are buffered to find the kind of g before its call
+    class Pipe(io.StringIO):
+        def seekable(self):
+            return False
+
+    code = list(Compiler(engine='streaming').compile(Pipe('''
+        class Main {
+            method int f() { return g(); }
+            method int g() { return 2; }
+        }
+    ''')))
+    i = code.index('call Main.g 1')
+    assert code[i - 1] == 'push pointer 0'
+
+
+def test_streaming_engine(vm):
+    c = Compiler(engine='streaming')
+    vm.load(c.compile(io.StringIO('''
+        class Main {
+            field int total;
+
+            function int run(int n) {
+                var Main m;
+                let m = Main.new();
+                while (n > 0) {
+                    if (n = 2) {
+                        do m.add(20);
+                    } else {
+                        do m.add(n);
+                    }
+                    let n = n - 1;
+                }
+                return m.get();
+            }
+
+            constructor Main new() {
+                let total = 0;
+                return this;
+            }
+
+            method void add(int x) {
+                let total = total + x;
+                return;
+            }
+
+            method int get() {
+                return total;
+            }
+        }
+    ''')))
+
+    vm.execute([
+        'push constant 4',
+        'call Main.run 1',
+    ])
+
+    assert vm.stack == [4 + 3 + 20 + 1]
+
+
+def test_labels_are_numbered_per_function():
+    source = '''
+        class Main {
+            function void f(int x) {
+                while (x) { if (x) { let x = 0; } }
+                return;
+            }
+            function void g(int x) {
+                if (x) { let x = 1; }
+                return;
+            }
+        }
+    '''
+    for engine in Compiler.engines:
+        code = list(Compiler(engine=engine).compile(io.StringIO(source)))
+        assert code == list(Compiler(engine=engine).compile(
+            io.StringIO(source)))
+        labels = [cmd.split()[1] for cmd in code if cmd.startswith('label')]
+        assert labels == ['while-condition-0', 'while-begin-0', 'if-1',
+            'else-1', 'end-if-1', 'while-end-0', 'if-0', 'else-0', 'end-if-0']
+
+
+@pytest.mark.parametrize('engine', Compiler.engines)
+def test_check_file(tmp_path, engine):
+    # the second compile runs in a new interpreter: the labels must not
+    # depend on id() or on the hash seed
+    source = tmp_path / 'Main.jack'
+    source.write_text('''
+        class Main {
+            function void f(int x) {
+                while (x) { if (x) { let x = 0; } else { let x = 1; } }
+                return;
+            }
+        }
+    ''')
+    assert check_file(str(source), engine=engine) is None
+
+
+def test_check_file_catches_id_labels(tmp_path, monkeypatch):
+    def new_label(self, node):
+        self._label_numbers[node] = id(node)
+        return id(node)
+
+    source = tmp_path / 'Main.jack'
+    source.write_text('''
+        class Main {
+            function void f(int x) {
+                if (x) { let x = 0; }
+                return;
+            }
+        }
+    ''')
+    monkeypatch.setattr(CodeGenerator, '_new_label', new_label)
+    assert 'label if-' in check_file(str(source))
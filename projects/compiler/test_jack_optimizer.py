@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+from jack_compiler import Compiler
+from vm_emulator import VMEmulator
+
+
+def compile_expression(expression, optimize):
+    c = Compiler(optimize=optimize)
+    code = list(c.compile(io.StringIO('''
+        class Main {
+            function int f(int x) {
+                return %s;
+            }
+        }
+    ''' % expression)))
+    return code, c.stats
+
+
+def evaluate(code, x):
+    vm = VMEmulator()
+    vm.load(code)
+    vm.execute([f'push constant {abs(x)}'] + ['neg'] * (x < 0)
+        + ['call Main.f 1'])
+    return vm.stack[-1]
+
+
+@pytest.mark.parametrize('expression, value', [
+    ('2 * (3 + 4) - (-4)', 18),
+    ('32767 + 1', -32768),
+    ('0 - 32767 - 1', -32768),
+    ('-32767 - 2', 32767),
+    ('300 * 300', 24464),
+    ('-7 / 2', -3),
+    ('7 / -2', -3),
+    ('6 & 3 | 8', 10),
+    ('~0', -1),
+    ('(1 < 2) & (3 > 4)', 0),
+    ('(2 = 2) | false', -1),
+    ('~true', 0),
+])
+def test_constant_folding(expression, value):
+    code, stats = compile_expression(expression, optimize=2)
+    assert stats['constant-fold'] > 0
+    # a single constant: push, and neg or not for the negative ones
+    assert len([cmd for cmd in code if cmd.startswith('push')]) == 1
+    assert not any(cmd.startswith('call') for cmd in code)
+    assert evaluate(code, 0) == value
+
+
+@pytest.mark.parametrize('expression', ['1 / 0', '(0 - 32767 - 1) / -1'])
+def test_no_folding(expression):
+    code, _ = compile_expression(expression, optimize=2)
+    assert 'call Math.divide 2' in code
+
+
+@pytest.mark.parametrize('expression', [
+    'x * 0', 'x * 1', '1 * x', 'x * 2', '3 * x', 'x * 4', 'x * -1',
+    'x * -3', 'x + 0', '0 + x', 'x - 0', 'x / 1', '(x + 1) * 1',
+])
+def test_strength_reduction(expression):
+    code, stats = compile_expression(expression, optimize=2)
+    reference, _ = compile_expression(expression, optimize=0)
+    assert not any('Math.' in cmd for cmd in code)
+    assert stats['multiply-chain'] + stats['identity'] == 1
+    for x in (0, 1, -5, 123, 20000):
+        assert evaluate(code, x) == evaluate(reference, x)
+
+
+@pytest.mark.parametrize('expression', ['x * 5', '(x + 1) * 2', 'x * x'])
+def test_multiply_kept(expression):
+    code, stats = compile_expression(expression, optimize=2)
+    assert 'call Math.multiply 2' in code
+    assert not stats
+
+
+def test_streaming_engine():
+    with pytest.raises(ValueError):
+        Compiler(engine='streaming', optimize=2)
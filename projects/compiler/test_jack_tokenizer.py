@@ -1,4 +1,6 @@
+import glob
 import io
+import os
 import tokenize
 import pytest
 
@@ -121,3 +123,55 @@ def test_multi_line_comment():
     assert next(tokens).value == 'x'
     assert next(tokens).value == ','
     assert next(tokens).value == 'y'
+
+
+def test_engines_agree():
+    root = os.path.join(os.path.dirname(__file__), '..', '..')
+    sources = glob.glob(os.path.join(root, 'projects', '*', '*.jack'))
+    sources += glob.glob(os.path.join(root, 'projects', '*', '*', '*.jack'))
+    assert sources
+
+    def tokens(engine, path):
+        t = jack_tokenizer.Tokenizer(engine)
+        return [(tok.lineno, tok.type, tok.value) for tok in t.tokenize(path)]
+
+    for path in sources:
+        assert tokens('regex', path) == tokens('char', path), path
+
+
+@pytest.mark.parametrize('source, expected', [
+    ('x /y', ['x', '/', 'y', 'EOF']),
+    ('x // comment', ['x', 'EOF']),
+])
+def test_regex_engine(source, expected):
+    t = jack_tokenizer.Tokenizer()
+    tokens = t.tokenize(io.StringIO(source))
+    assert [tok.value for tok in tokens] == expected
+
+
+def test_unterminated_comment():
+    t = jack_tokenizer.Tokenizer()
+
+    with pytest.raises(jack_tokenizer.TokenizerError):
+        list(t.tokenize(io.StringIO('x /* comment')))
+
+
+@pytest.mark.parametrize('engine', jack_tokenizer.Tokenizer.engines)
+def test_interned_values(engine):
+    t = jack_tokenizer.Tokenizer(engine)
+    tokens = list(t.tokenize(io.StringIO(''.join(['class', ' {'] * 2))))
+
+    assert tokens[0].value == 'class'
+    assert tokens[0].value is tokens[2].value
+    assert tokens[1].value is tokens[3].value
+    assert tokens[0].type is jack_tokenizer.KEYWORD
+    assert tokens[1].type is jack_tokenizer.SYMBOL
+    assert not hasattr(tokens[0], '__dict__')
+
+
+@pytest.mark.parametrize('engine', jack_tokenizer.Tokenizer.engines)
+def test_comment_closed_by_its_own_star(engine):
+    # in '/*/' the '*' opens the comment, it does not close it as well
+    t = jack_tokenizer.Tokenizer(engine)
+    tokens = t.tokenize(io.StringIO('x /*/ y */ z /**/ w'))
+    assert [tok.value for tok in tokens] == ['x', 'z', 'w', 'EOF']
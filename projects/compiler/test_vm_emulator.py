@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+from vm_emulator import VMEmulator, MaxStepsExceededError, SysError
+
+
+@pytest.fixture
+def vm():
+    return VMEmulator()
+
+
+def test_labels_are_function_scoped(vm):
+    vm.load([
+        'function A.fn 0',
+        'goto end',
+        'push constant 1',
+        'label end',
+        'push constant 10',
+        'return',
+
+        'function B.fn 0',
+        'goto end',
+        'label end',
+        'push constant 20',
+        'return',
+    ])
+
+    vm.execute([
+        'call A.fn 0',
+        'call B.fn 0',
+        'add',
+    ])
+
+    assert vm.stack == [30]
+
+
+def test_max_steps(vm):
+    vm.load([
+        'function Main.loop 0',
+        'label loop',
+        'goto loop',
+    ])
+
+    with pytest.raises(MaxStepsExceededError):
+        vm.execute(['call Main.loop 0'], max_steps=1000)
+
+
+def os_vm_files(*names):
+    os_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'tools', 'OS')
+    for name in names:
+        with open(os.path.join(os_dir, name + '.vm')) as f:
+            yield from f
+
+
+def run_os(os, commands):
+    vm = VMEmulator(os=os)
+    vm.load(os_vm_files(
+        'Math', 'Memory', 'Array', 'String', 'Output', 'Screen'))
+    vm.execute(['call Memory.init 0', 'call Math.init 0', 'call Screen.init 0',
+        'call Output.init 0']
+        + commands, max_steps=10_000_000)
+    return vm
+
+
+@pytest.mark.parametrize('fn, args', [
+    ('Math.multiply', (123, 45)),
+    ('Math.multiply', (-123, 45)),
+    ('Math.multiply', (300, 300)),
+    ('Math.divide', (1000, 7)),
+    ('Math.divide', (-1000, 7)),
+    ('Math.divide', (1000, -7)),
+    ('Math.sqrt', (1000,)),
+    ('Math.sqrt', (32767,)),
+    ('Math.abs', (-5,)),
+    ('Math.min', (3, -4)),
+    ('Math.max', (3, -4)),
+])
+def test_native_math(fn, args):
+    commands = [f'push constant {abs(a)}' + ('\nneg' if a < 0 else '')
+        for a in args]
+    commands = '\n'.join(commands).split('\n') + [f'call {fn} {len(args)}']
+    assert run_os('native', commands).stack[-1] == \
+        run_os('vm', commands).stack[-1]
+
+
+def test_native_output():
+    commands = [
+        'push constant 12345',
+        'neg',
+        'call Output.printInt 1',
+        'call Output.println 0',
+        'push constant 65',
+        'call Output.printChar 1',
+        'call Output.backSpace 0',
+        'push constant 66',
+        'call Output.printChar 1',
+        'push constant 5',
+        'push constant 63',
+        'call Output.moveCursor 2',
+        'push constant 67',
+        'call Output.printChar 1',
+        'push constant 68',
+        'call Output.printChar 1',
+    ]
+    native = run_os('native', commands)
+    emulated = run_os('vm', commands)
+    screen = slice(VMEmulator.screen, VMEmulator.keyboard)
+    assert native.heap[screen] == emulated.heap[screen]
+    assert ''.join(native.output) == '-12345\nBC\nD'
+
+
+def test_native_screen():
+    commands = [
+        'push constant 3', 'push constant 5',
+        'push constant 100', 'push constant 40',
+        'call Screen.drawLine 4',
+        'push constant 30', 'push constant 200',
+        'push constant 10', 'push constant 7',
+        'call Screen.drawLine 4',
+        'push constant 20', 'push constant 50',
+        'push constant 70', 'push constant 60',
+        'call Screen.drawRectangle 4',
+        'push constant 0',
+        'call Screen.setColor 1',
+        'push constant 40', 'push constant 55',
+        'push constant 8',
+        'call Screen.drawCircle 3',
+    ]
+    native = run_os('native', commands)
+    emulated = run_os('vm', commands)
+    screen = slice(VMEmulator.screen, VMEmulator.keyboard)
+    assert native.heap[screen] == emulated.heap[screen]
+
+
+def test_native_errors():
+    vm = VMEmulator()
+    vm.load([])
+    with pytest.raises(SysError, match='3'):
+        vm.execute([
+            'push constant 1',
+            'push constant 0',
+            'call Math.divide 2',
+        ])
+
+
+def test_native_alloc_reuses_freed_blocks():
+    vm = VMEmulator()
+    vm.load([])
+    vm.execute([
+        'push constant 10',
+        'call Memory.alloc 1',
+        'call Memory.deAlloc 1',
+        'pop temp 0',
+        'push constant 4',
+        'call Memory.alloc 1',
+    ])
+    assert vm.stack == [VMEmulator.heap_base]
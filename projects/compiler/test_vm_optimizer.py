@@ -0,0 +1,131 @@
+import io
+import os
+
+import pytest
+
+from jack_compiler import Compiler
+from vm_emulator import VMEmulator
+from vm_optimizer import PeepholeOptimizer
+
+
+def optimize(code):
+    optimizer = PeepholeOptimizer()
+    return list(optimizer.optimize(code)), dict(optimizer.stats)
+
+
+@pytest.mark.parametrize('code, expected, stats', [
+    (['push local 0', 'not', 'not'], ['push local 0'], {'double-not': 1}),
+    (['push constant 1', 'neg', 'not'], ['push constant 0'],
+        {'not-true': 1}),
+    (['label a', 'push constant 0', 'if-goto a', 'push local 0'],
+        ['push local 0'], {'const-branch': 1, 'dead-label': 1}),
+    (['label a', 'push constant 1', 'neg', 'if-goto a'],
+        ['label a', 'goto a'], {'const-branch': 1}),
+    (['push argument 0', 'push argument 1', 'lt', 'not', 'if-goto a',
+            'goto b', 'label a', 'push constant 1', 'label b'],
+        ['push argument 0', 'push argument 1', 'lt', 'if-goto b',
+            'push constant 1', 'label b'],
+        {'invert-branch': 1, 'dead-label': 1}),
+    (['push local 0', 'push local 1', 'add', 'push argument 0',
+            'pop temp 0', 'pop pointer 1', 'push temp 0', 'pop that 0'],
+        ['push local 0', 'push local 1', 'add', 'pop pointer 1',
+            'push argument 0', 'pop that 0'],
+        {'array-store': 1}),
+    (['push local 0', 'return', 'push local 1', 'label a', 'goto a'],
+        ['push local 0', 'return', 'label a', 'goto a'],
+        {'unreachable': 1}),
+    (['goto a', 'label b', 'label a', 'goto b'],
+        ['label b', 'goto b'],
+        {'jump-to-next': 1, 'dead-label': 1}),
+])
+def test_rules(code, expected, stats):
+    assert optimize(code) == (expected, stats)
+
+
+def test_keeps_comments_and_functions():
+    code = [
+        '// Main',
+        'function Main.f 0',
+        'push argument 0  // x',
+        'not',
+        '// ~x',
+        'not',
+        'return',
+        'function Main.g 0',
+        'label a',
+        'goto a',
+    ]
+    assert optimize(code) == ([
+        '// Main',
+        'function Main.f 0',
+        'push argument 0  // x',
+        '// ~x',
+        'return',
+        'function Main.g 0',
+        'label a',
+        'goto a',
+    ], {'double-not': 1})
+
+
+def test_array_store_keeps_that_reads():
+    # the value depends on `that`, it has to be read before `pop pointer 1`
+    code = ['push local 0', 'push that 0', 'pop temp 0', 'pop pointer 1',
+        'push temp 0', 'pop that 0']
+    assert optimize(code) == (code, {})
+
+
+def test_optimized_code():
+    source = '''
+        class Main {
+            function int run(int n) {
+                var Array a;
+                var int i, sum;
+                let a = Array.new(n);
+                let i = 0;
+                while (~(i = n)) {
+                    let a[i] = i;
+                    let i = i + 1;
+                }
+                let i = 0;
+                while (true) {
+                    if (~(i < n)) {
+                        return sum;
+                    }
+                    if (~false) {
+                        let sum = sum + a[i];
+                    }
+                    let i = i + 1;
+                }
+                return 0;
+            }
+        }
+    '''
+    c = Compiler(optimize=1)
+    code = list(c.compile(io.StringIO(source)))
+    assert len(code) < len(list(Compiler().compile(io.StringIO(source))))
+    assert set(c.stats) >= {'invert-branch', 'const-branch', 'array-store',
+        'unreachable', 'dead-label'}
+
+    vm = VMEmulator()
+    vm.load(code)
+    vm.execute(['push constant 10', 'call Main.run 1'])
+    assert vm.stack == [45]
+
+
+@pytest.mark.parametrize('name', ['Seven', 'ComplexArrays', 'ConvertToBin'])
+def test_optimized_programs(name):
+    path = os.path.join(os.path.dirname(__file__), '..', '11', name,
+        'Main.jack')
+    results = []
+    for level in Compiler.levels:
+        vm = VMEmulator()
+        vm.load(Compiler(optimize=level).compile(path))
+        vm.execute(['call Main.main 0'])
+        results.append((vm.output, vm.stack))
+    assert all(result == results[0] for result in results)
+    assert results[0][0] or name == 'ConvertToBin'
+
+
+def test_unknown_level():
+    with pytest.raises(ValueError):
+        Compiler(optimize=3)
@@ -1,17 +1,65 @@
 import itertools
 
 class Node:
-    def __init__(self, parent, name, value):
-        self.parent = parent
+    # `depth` is kept up to date when subtrees move; with link_parent=False
+    # the node does not reference its parent (the tree is still built top
+    # down), which is enough for the visitors that do not look up; `lineno`
+    # is the line of the first token of the node, None for the nodes that
+    # do not come from the source
+    __slots__ = ('parent', 'name', 'value', 'children', 'depth', 'lineno')
+
+    def __init__(self, parent, name, value, link_parent=True, lineno=None):
+        self.parent = parent if link_parent else None
         self.name = name
         self.value = value
         self.children = []
+        self.lineno = lineno
 
         if parent is not None:
             parent.children.append(self)
+            self.depth = parent.depth + 1
+        else:
+            self.depth = 0
+
+    def append(self, child, link_parent=True):
+        # attach a detached node
+        self.children.append(child)
+        child.parent = self if link_parent else None
+        child._set_depth(self.depth + 1)
+
+    def pop(self):
+        # detach the last child, O(1)
+        child = self.children.pop()
+        child.parent = None
+        return child
 
     def remove(self, child):
-        self.children = [c for c in self.children if c != child]
+        if self.children and self.children[-1] is child:
+            self.pop()
+            return
+        for i, c in enumerate(self.children):
+            if c is child:
+                del self.children[i]
+                child.parent = None
+                return
+
+    def replace(self, child, new, link_parent=True):
+        # put a detached node in the place of a child
+        for i, c in enumerate(self.children):
+            if c is child:
+                self.children[i] = new
+                child.parent = None
+                new.parent = self if link_parent else None
+                new._set_depth(self.depth + 1)
+                return
+
+    def _set_depth(self, depth):
+        nodes = [(self, depth)]
+        while nodes:
+            node, depth = nodes.pop()
+            if node.depth != depth:
+                node.depth = depth
+                nodes.extend((child, depth + 1) for child in node.children)
 
     def print(self):
         def print_node(depth, node):
@@ -20,11 +68,6 @@ class Node:
                 print_node(depth + 1, child)
         print_node(0, self)
 
-    def depth(self):
-        if self.parent is None:
-            return 0
-        return 1 + self.parent.depth()
-
 
 class Visitor:
     def __init__(self, generator=False):
@@ -32,7 +75,7 @@ class Visitor:
 
     def visit(self, root):
         handler = getattr(self, 'visit_' + root.name, self.default_visit)
-        # print(' ' * root.depth() * 4, root.name, root.value)
+        # print(' ' * root.depth * 4, root.name, root.value)
 
         children = (self.visit(child) for child in root.children)
         if self._generator:
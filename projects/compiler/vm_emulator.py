@@ -1,9 +1,17 @@
 import collections
 
+from vm_os import NativeOS, SysError, to_int16
+
+
+class MaxStepsExceededError(RuntimeError):
+    pass
+
+
 class Frame:
-    def __init__(self, pc, stack_size, memory):
+    def __init__(self, pc, stack_size, memory, function):
         self.pc = pc
         self.stack_size = stack_size
+        self.function = function
         self.segments = dict(
             argument = memory['argument'],
             local = memory['local'],
@@ -12,17 +20,49 @@ class Frame:
         )
 
 
-class VMEmulator:
-    def __init__(self):
+class VMEmulator(NativeOS):
+    # the Hack RAM layout, the stack and the segments are kept aside
+    ram_size = 32 * 1024
+    heap_base = 2048
+    heap_end = 16384
+
+    commands = ['push', 'pop', 'add', 'sub', 'neg', 'eq', 'gt', 'lt',
+        'and', 'or', 'not', 'label', 'goto', 'if-goto', 'function', 'call',
+        'return']
+
+    # where the OS functions come from: `native` binds the calls to the
+    # Python builtins even if the OS .vm files are loaded, `vm` runs the
+    # loaded OS as any other program code
+    oses = ('native', 'vm')
+
+    def __init__(self, trace=False, os='native'):
+        if os not in self.oses:
+            raise ValueError(f'unknown os: {os}')
+        self.trace = trace
+        self.os = os
         self.memory = collections.defaultdict(list)
         self.stack = []
-        self.heap = []
+        self.heap = [0] * self.ram_size
+        self.heap_free = self.heap_base
         self.program = None
         self.program_size = None
+        # predecoded program, [(handler, args)]
+        self.code = None
         self.pc = 0
+        self.function = None
+
+        # function name -> pc, (function name, label) -> pc
+        self.functions = {}
+        self.labels = {}
 
         self.caller_frame = []
 
+        self.handlers = {
+            cmd: getattr(self, '_' + cmd.replace('-', '_'))
+            for cmd in self.commands}
+
+        self._os_reset()
+
     def _parse(self, prog):
         def parse(cmd):
             cmd = cmd.split('//')[0].strip()
@@ -34,14 +74,68 @@ class VMEmulator:
 
     def load(self, program):
         program = list(program)
-        print()
-        for i, cmd in enumerate(program):
-            print('>>>', i+1, cmd)
+        if self.trace:
+            print()
+            for i, cmd in enumerate(program):
+                print('>>>', i+1, cmd)
         self.program = self._parse(program)
         self.program_size = len(self.program)
-
-    def execute(self, commands):
-        assert self.program
+        self.functions.clear()
+        self.labels.clear()
+        self._index(0)
+        self.code = self._decode_program(0)
+
+    def _decode_program(self, start):
+        # the static segment is shared by the functions of a class (file)
+        cls = None
+        code = []
+        for cmd in self.program[start:]:
+            if cmd[0] == 'function':
+                cls = cmd[1].split('.')[0]
+            code.append(self._decode(cmd, cls))
+        return code
+
+    def _decode(self, cmd, cls=None):
+        def handle_numbers(string):
+            try:
+                return int(string)
+            except ValueError:
+                return string
+        args = tuple(map(handle_numbers, cmd[1:]))
+
+        if cmd[0] in ('push', 'pop') and args[0] == 'static':
+            args = ('static', (cls, args[1]))
+
+        if cmd[0] == 'call' and self.os == 'native':
+            builtin = '_builtin_' + args[0].lower().replace('.', '_')
+            if hasattr(self, builtin):
+                return getattr(self, builtin), ()
+
+        try:
+            return self.handlers[cmd[0]], args
+        except KeyError:
+            raise RuntimeError(f'unknown command: {" ".join(cmd)}')
+
+    def _index(self, start):
+        # labels are scoped by the enclosing function, the same way
+        # the translator scopes them
+        function = None
+        for i in range(start, len(self.program)):
+            cmd = self.program[i]
+            if cmd[0] == 'function':
+                function = cmd[1]
+                self.functions[function] = i
+            elif cmd[0] == 'label':
+                self.labels[function, cmd[1]] = i
+
+    def _drop_index(self, start):
+        for index in [self.functions, self.labels]:
+            for key, pc in list(index.items()):
+                if pc >= start:
+                    del index[key]
+
+    def execute(self, commands, max_steps=1_000_000):
+        assert self.program is not None
 
         self.stack.clear()
         self.memory.clear()
@@ -52,31 +146,29 @@ class VMEmulator:
         self.memory['temp'] = [0] * 8
         self.program = self.program[:self.program_size]
         self.program.extend(self._parse(commands))
+        self._drop_index(self.program_size)
+        self._index(self.program_size)
+        self.code = self.code[:self.program_size]
+        self.code.extend(self._decode_program(self.program_size))
         self.pc = self.program_size
+        self.function = None
 
+        code = self.code
+        size = len(code)
+        trace = self.trace
         total_commands = 0
-        while self.pc < len(self.program):
-            self._execute(self.program[self.pc])
+        while self.pc < size:
+            if total_commands == max_steps:
+                raise MaxStepsExceededError(max_steps)
+
+            pc = self.pc
+            handler, args = code[pc]
+            if trace:
+                print('#', pc, self.program[pc])
+            handler(*args)
+            if self.pc == pc:
+                self.pc = pc + 1
             total_commands += 1
-            assert total_commands < 100
-
-    def _execute(self, cmd):
-        print('#', self.pc, cmd)
-
-        def handle_numbers(string):
-            try:
-                return int(string)
-            except ValueError:
-                return string
-        cmd = tuple(map(handle_numbers, cmd))
-
-        instruction = cmd[0].replace('-', '_')
-        handler = getattr(self, f'_{instruction}')
-
-        prev_pc = self.pc
-        handler(*cmd[1:])
-        if self.pc == prev_pc:
-            self.pc += 1
 
     def _push(self, segment, index):
         if segment in ['this', 'that']:
@@ -103,34 +195,26 @@ class VMEmulator:
             self.memory[segment][index] = value
 
     def _call(self, function, nargs):
-        def convert_builtin(function):
-            return '_builtin_' + function.lower().replace('.', '_')
-        if hasattr(self, convert_builtin(function)):
-            getattr(self, convert_builtin(function))()
-            return
-
-        self.caller_frame.append(Frame(self.pc, len(self.stack), self.memory))
+        # builtins are resolved when the call is decoded
+        self.caller_frame.append(
+            Frame(self.pc, len(self.stack), self.memory, self.function))
 
         self.memory['argument'] = list(reversed([
             self.stack.pop() for i in range(nargs)]))
         self.memory['local'] = []
         self.memory['this'] = [0]
         self.memory['that'] = [0]
-        self.pc = self.__find('function', function)
-
-    def __find(self, *args):
-        for i, cmd in enumerate(self.program):
-            if cmd[:len(args)] == args:
-                return i
-        assert False, args
+        self.pc = self.functions[function]
 
     def _return(self):
         frame = self.caller_frame.pop()
         for segment, data in frame.segments.items():
             self.memory[segment] = data
+        self.function = frame.function
         self.pc = frame.pc + 1
 
     def _function(self, name, nlocals):
+        self.function = name
         self.memory['local'] = [0] * nlocals
 
     def _label(self, name):
@@ -138,76 +222,51 @@ class VMEmulator:
         pass
 
     def _goto(self, label):
-        self.pc = self.__find('label', label)
+        self.pc = self.labels[self.function, label]
 
     def _if_goto(self, label):
         if self.stack.pop():
             self._goto(label)
 
-    def _builtin_memory_alloc(self):
-        nbytes = self.stack.pop()
-        assert nbytes > 0
-        address = len(self.heap)
-        self.heap.extend([0] * nbytes)
-        self.stack.append(address)
-
-    def _builtin_string_new(self):
-        size = self.stack.pop() + 2
-        address = len(self.heap)
-        self.heap.extend([0] * size)
-        self.heap[address] = size
-        self.heap[address + 1] = 0
-        self.stack.append(address)
-
-    def _builtin_string_appendchar(self):
-        ch = self.stack.pop()
-        address = self.stack.pop()
-        capacity = self.heap[address]
-        size = self.heap[address + 1]
-        assert size < capacity
-        self.heap[address + 2 + size] = ch
-        self.heap[address + 1] = size + 1
-        self.stack.append(address)
-
-    def _builtin_string_charat(self):
-        idx = self.stack.pop()
-        address = self.stack.pop()
-        size = self.heap[address + 1]
-        assert idx < size
-        self.stack.append(self.heap[address + 2 + idx])
-
-    def _builtin_array_new(self):
-        size = self.stack.pop()
-        assert size > 0
-        address = len(self.heap)
-        self.heap.extend([0] * size)
-        self.stack.append(address)
-
     def _add(self):
         b = self.stack.pop()
         a = self.stack.pop()
-        self.stack.append(a + b)
+        self.stack.append(to_int16(a + b))
 
     def _eq(self):
         b = self.stack.pop()
         a = self.stack.pop()
-        self.stack.append(a == b)
+        self.stack.append(-(a == b))
 
     def _lt(self):
         b = self.stack.pop()
         a = self.stack.pop()
-        self.stack.append(a < b)
+        self.stack.append(-(a < b))
 
     def _gt(self):
         b = self.stack.pop()
         a = self.stack.pop()
-        self.stack.append(a > b)
+        self.stack.append(-(a > b))
 
     def _sub(self):
         b = self.stack.pop()
         a = self.stack.pop()
-        self.stack.append(a - b)
+        self.stack.append(to_int16(a - b))
 
     def _neg(self):
         a = self.stack.pop()
-        self.stack.append(-a)
+        self.stack.append(to_int16(-a))
+
+    def _and(self):
+        b = self.stack.pop()
+        a = self.stack.pop()
+        self.stack.append(a & b)
+
+    def _or(self):
+        b = self.stack.pop()
+        a = self.stack.pop()
+        self.stack.append(a | b)
+
+    def _not(self):
+        a = self.stack.pop()
+        self.stack.append(~a)
@@ -0,0 +1,173 @@
+import collections
+
+
+def _op(line):
+    # the words of a command without the comment, () for comment lines
+    return tuple(line.split('//', 1)[0].split())
+
+
+comparisons = {('eq',), ('lt',), ('gt',)}
+
+
+class PeepholeOptimizer:
+    # rewrites the VM code function by function, until none of the rules
+    # applies; `stats` counts the hits per rule
+    rules = ('double-not', 'not-true', 'const-branch', 'invert-branch',
+        'array-store', 'unreachable', 'jump-to-next', 'dead-label')
+
+    def __init__(self, stats=None):
+        self.stats = collections.Counter() if stats is None else stats
+
+    def optimize(self, commands):
+        function = []
+        for line in commands:
+            if _op(line)[:1] == ('function',) and function:
+                yield from self._optimize(function)
+                function = []
+            function.append(line)
+        yield from self._optimize(function)
+
+    def _optimize(self, lines):
+        # [op, line], comment lines stay in place and never match
+        code = [[_op(line), line] for line in lines]
+        while True:
+            changed = False
+            for rule in self.rules:
+                hits = getattr(self, '_' + rule.replace('-', '_'))(code)
+                if hits:
+                    self.stats[rule] += hits
+                    code = [entry for entry in code if entry is not None]
+                    changed = True
+            if not changed:
+                break
+        return [line for _, line in code]
+
+    def _windows(self, code, size):
+        # index lists of `size` consecutive commands, skipping comments
+        window = []
+        for i, entry in enumerate(code):
+            if entry is None or not entry[0]:
+                continue
+            window.append(i)
+            if len(window) > size:
+                del window[0]
+            if len(window) == size:
+                yield list(window)
+
+    def _rewrite(self, code, size, match):
+        # match(ops) returns None or the replacement [op, line] entries,
+        # which take the places of the first ones of the window
+        hits = 0
+        consumed = -1
+        for window in self._windows(code, size):
+            if window[0] <= consumed:
+                continue
+            replacement = match([code[i][0] for i in window],
+                [code[i][1] for i in window])
+            if replacement is None:
+                continue
+            for i, entry in zip(window, replacement + [None] * size):
+                code[i] = entry
+            consumed = window[-1]
+            hits += 1
+        return hits
+
+    def _double_not(self, code):
+        def match(ops, lines):
+            if ops == [('not',), ('not',)]:
+                return []
+        return self._rewrite(code, 2, match)
+
+    def _not_true(self, code):
+        # true is `push constant 1; neg`
+        def match(ops, lines):
+            if ops == [('push', 'constant', '1'), ('neg',), ('not',)]:
+                return [[('push', 'constant', '0'), 'push constant 0']]
+        return self._rewrite(code, 3, match)
+
+    def _const_branch(self, code):
+        # if-goto on true (-1, ~0 or any other constant) or false
+        def match(ops, lines):
+            *value, branch = ops
+            if branch[0] != 'if-goto':
+                return None
+            if value in ([('push', 'constant', '1'), ('neg',)],
+                    [('push', 'constant', '0'), ('not',)]):
+                return [[('goto', branch[1]), f'goto {branch[1]}']]
+            return None
+        hits = self._rewrite(code, 3, match)
+
+        def match_pair(ops, lines):
+            value, branch = ops
+            if branch[0] != 'if-goto' or value[:2] != ('push', 'constant'):
+                return None
+            if value[2] == '0':
+                return []
+            return [[('goto', branch[1]), f'goto {branch[1]}']]
+        return hits + self._rewrite(code, 2, match_pair)
+
+    def _invert_branch(self, code):
+        # `cmp; not; if-goto X; goto Y; label X` is `cmp; if-goto Y;
+        # label X`, a comparison is either true (-1) or false (0)
+        def match(ops, lines):
+            cmp, neg, branch, goto, label = ops
+            if (cmp in comparisons and neg == ('not',)
+                    and branch[0] == 'if-goto' and goto[0] == 'goto'
+                    and label == ('label', branch[1])):
+                return [[cmp, lines[0]],
+                    [('if-goto', goto[1]), f'if-goto {goto[1]}'],
+                    [label, lines[4]]]
+        return self._rewrite(code, 5, match)
+
+    def _array_store(self, code):
+        # `a[i] = x` with x a single push: set `that` before pushing x
+        # instead of keeping x in temp 0 meanwhile
+        def match(ops, lines):
+            if (ops[0][0] == 'push' and ops[0][1] not in ('that', 'pointer')
+                    and ops[1:] == [('pop', 'temp', '0'),
+                        ('pop', 'pointer', '1'), ('push', 'temp', '0'),
+                        ('pop', 'that', '0')]):
+                return [[ops[2], lines[2]], [ops[0], lines[0]],
+                    [ops[4], lines[4]]]
+        return self._rewrite(code, 5, match)
+
+    def _unreachable(self, code):
+        # the commands after goto or return up to the next label
+        hits = 0
+        dead = False
+        for i, (op, _) in enumerate(code):
+            if not op:
+                continue
+            if op[0] in ('label', 'function'):
+                dead = False
+            elif dead:
+                code[i] = None
+                hits += 1
+            elif op[0] in ('goto', 'return'):
+                dead = True
+        return hits
+
+    def _jump_to_next(self, code):
+        hits = 0
+        for i, (op, _) in enumerate(code):
+            if not op or op[0] != 'goto':
+                continue
+            for entry in code[i + 1:]:
+                if entry is None or not entry[0]:
+                    continue
+                if entry[0][0] != 'label':
+                    break
+                if entry[0][1] == op[1]:
+                    code[i] = None
+                    hits += 1
+                    break
+        return hits
+
+    def _dead_label(self, code):
+        used = {op[1] for op, _ in code if op and op[0] in ('goto', 'if-goto')}
+        hits = 0
+        for i, (op, _) in enumerate(code):
+            if op and op[0] == 'label' and op[1] not in used:
+                code[i] = None
+                hits += 1
+        return hits
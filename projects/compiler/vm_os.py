@@ -0,0 +1,535 @@
+import math
+
+
+class SysError(RuntimeError):
+    pass
+
+
+def to_int16(value):
+    return ((value + 0x8000) & 0xffff) - 0x8000
+
+
+class NativeOS:
+    # Python implementations of the Jack OS API (tools/OS/*.vm): the same
+    # arguments, results and error codes. Builtins pop their arguments and
+    # push the result, void functions push 0. Objects live in the heap, but
+    # their layout is private to the builtins, so a class must be either
+    # native or loaded from the .vm files as a whole.
+    screen = 16384
+    screen_width = 512
+    screen_height = 256
+    keyboard = 24576
+
+    text_rows = 23
+    text_cols = 64
+
+    new_line = 128
+    back_space = 129
+    double_quote = 34
+
+    def _os_reset(self):
+        self.cursor = (0, 0)
+        self.color = True
+        # address -> size of the allocated and of the free blocks
+        self.heap_blocks = {}
+        self.heap_free_blocks = {}
+        # everything printed with Output
+        self.output = []
+
+    def _args(self, n):
+        args = self.stack[-n:]
+        del self.stack[-n:]
+        return args
+
+    def _os_error(self, code):
+        raise SysError(f'Sys.error {code}')
+
+    #
+    # Math
+    #
+    def _builtin_math_init(self):
+        self.stack.append(0)
+
+    def _builtin_math_abs(self):
+        x, = self._args(1)
+        self.stack.append(to_int16(abs(x)))
+
+    def _builtin_math_multiply(self):
+        x, y = self._args(2)
+        self.stack.append(to_int16(x * y))
+
+    def _builtin_math_divide(self):
+        x, y = self._args(2)
+        if y == 0:
+            self._os_error(3)
+        q = abs(x) // abs(y)
+        self.stack.append(to_int16(q if (x < 0) == (y < 0) else -q))
+
+    def _builtin_math_sqrt(self):
+        x, = self._args(1)
+        if x < 0:
+            self._os_error(4)
+        self.stack.append(math.isqrt(x))
+
+    def _builtin_math_max(self):
+        self.stack.append(max(self._args(2)))
+
+    def _builtin_math_min(self):
+        self.stack.append(min(self._args(2)))
+
+    #
+    # Memory
+    #
+    def _builtin_memory_init(self):
+        self.stack.append(0)
+
+    def _builtin_memory_peek(self):
+        address, = self._args(1)
+        self.stack.append(self.heap[address])
+
+    def _builtin_memory_poke(self):
+        address, value = self._args(2)
+        self.heap[address] = value
+        self.stack.append(0)
+
+    def _builtin_memory_alloc(self):
+        size, = self._args(1)
+        if size <= 0:
+            self._os_error(5)
+        self.stack.append(self._alloc(size))
+
+    def _builtin_memory_dealloc(self):
+        address, = self._args(1)
+        self._dealloc(address)
+        self.stack.append(0)
+
+    def _alloc(self, size):
+        # first fit over the freed blocks, then the never used space
+        for address, free_size in self.heap_free_blocks.items():
+            if free_size >= size:
+                del self.heap_free_blocks[address]
+                if free_size > size:
+                    self.heap_free_blocks[address + size] = free_size - size
+                break
+        else:
+            address = self.heap_free
+            if address + size > self.heap_end:
+                self._os_error(6)
+            self.heap_free += size
+
+        self.heap_blocks[address] = size
+        self.heap[address:address + size] = [0] * size
+        return address
+
+    def _dealloc(self, address):
+        self.heap_free_blocks[address] = self.heap_blocks.pop(address)
+
+    #
+    # Array
+    #
+    def _builtin_array_new(self):
+        size, = self._args(1)
+        if size <= 0:
+            self._os_error(2)
+        self.stack.append(self._alloc(size))
+
+    def _builtin_array_dispose(self):
+        self._builtin_memory_dealloc()
+
+    #
+    # String, [max length, length, chars...]
+    #
+    def _string(self, address):
+        length = self.heap[address + 1]
+        return self.heap[address + 2:address + 2 + length]
+
+    def _builtin_string_new(self):
+        max_length, = self._args(1)
+        if max_length < 0:
+            self._os_error(14)
+        address = self._alloc(max_length + 2)
+        self.heap[address] = max_length
+        self.stack.append(address)
+
+    def _builtin_string_dispose(self):
+        self._builtin_memory_dealloc()
+
+    def _builtin_string_length(self):
+        address, = self._args(1)
+        self.stack.append(self.heap[address + 1])
+
+    def _builtin_string_charat(self):
+        address, idx = self._args(2)
+        if not 0 <= idx < self.heap[address + 1]:
+            self._os_error(15)
+        self.stack.append(self.heap[address + 2 + idx])
+
+    def _builtin_string_setcharat(self):
+        address, idx, ch = self._args(3)
+        if not 0 <= idx < self.heap[address + 1]:
+            self._os_error(16)
+        self.heap[address + 2 + idx] = ch
+        self.stack.append(0)
+
+    def _builtin_string_appendchar(self):
+        address, ch = self._args(2)
+        max_length, length = self.heap[address:address + 2]
+        if length == max_length:
+            self._os_error(17)
+        self.heap[address + 2 + length] = ch
+        self.heap[address + 1] = length + 1
+        self.stack.append(address)
+
+    def _builtin_string_eraselastchar(self):
+        address, = self._args(1)
+        if self.heap[address + 1] == 0:
+            self._os_error(18)
+        self.heap[address + 1] -= 1
+        self.stack.append(0)
+
+    def _builtin_string_intvalue(self):
+        address, = self._args(1)
+        chars = self._string(address)
+        sign = 1
+        if chars and chars[0] == ord('-'):
+            sign = -1
+            chars = chars[1:]
+        value = 0
+        for ch in chars:
+            if not ord('0') <= ch <= ord('9'):
+                break
+            value = value * 10 + ch - ord('0')
+        self.stack.append(to_int16(sign * value))
+
+    def _builtin_string_setint(self):
+        address, value = self._args(2)
+        chars = [ord(ch) for ch in str(value)]
+        if len(chars) > self.heap[address]:
+            self._os_error(19)
+        self.heap[address + 1] = len(chars)
+        self.heap[address + 2:address + 2 + len(chars)] = chars
+        self.stack.append(0)
+
+    def _builtin_string_newline(self):
+        self.stack.append(self.new_line)
+
+    def _builtin_string_backspace(self):
+        self.stack.append(self.back_space)
+
+    def _builtin_string_doublequote(self):
+        self.stack.append(self.double_quote)
+
+    #
+    # Output, 23 rows of 64 characters of 8x11 pixels, starting at the
+    # second pixel row of the screen
+    #
+    def _builtin_output_init(self):
+        self.cursor = (0, 0)
+        self.stack.append(0)
+
+    def _builtin_output_movecursor(self):
+        row, col = self._args(2)
+        if not (0 <= row < self.text_rows and 0 <= col < self.text_cols):
+            self._os_error(20)
+        self.cursor = (row, col)
+        self._draw_char(ord(' '))
+        self.stack.append(0)
+
+    def _builtin_output_printchar(self):
+        ch, = self._args(1)
+        self._print_char(ch)
+        self.stack.append(0)
+
+    def _builtin_output_printstring(self):
+        address, = self._args(1)
+        for ch in self._string(address):
+            self._print_char(ch)
+        self.stack.append(0)
+
+    def _builtin_output_printint(self):
+        value, = self._args(1)
+        for ch in str(value):
+            self._print_char(ord(ch))
+        self.stack.append(0)
+
+    def _builtin_output_println(self):
+        self._println()
+        self.stack.append(0)
+
+    def _builtin_output_backspace(self):
+        self._back_space()
+        self.stack.append(0)
+
+    def _print_char(self, ch):
+        if ch == self.new_line:
+            self._println()
+        elif ch == self.back_space:
+            self._back_space()
+        else:
+            self._draw_char(ch)
+            self.output.append(chr(ch))
+            row, col = self.cursor
+            if col == self.text_cols - 1:
+                self._println()
+            else:
+                self.cursor = (row, col + 1)
+
+    def _println(self):
+        row, _ = self.cursor
+        self.cursor = ((row + 1) % self.text_rows, 0)
+        self.output.append('\n')
+
+    def _back_space(self):
+        row, col = self.cursor
+        if col > 0:
+            self.cursor = (row, col - 1)
+        else:
+            self.cursor = ((row - 1) % self.text_rows, self.text_cols - 1)
+        self._draw_char(ord(' '))
+        if self.output:
+            self.output.pop()
+
+    def _draw_char(self, ch):
+        glyph = font.get(ch, font[0])
+        row, col = self.cursor
+        address = self.screen + (1 + row * 11) * 32 + col // 2
+        for bits in glyph:
+            word = self.heap[address]
+            if col % 2 == 0:
+                word = (word & -256) | bits
+            else:
+                word = (word & 255) | (bits << 8)
+            self.heap[address] = to_int16(word)
+            address += 32
+
+    #
+    # Screen
+    #
+    def _builtin_screen_init(self):
+        self.color = True
+        self.stack.append(0)
+
+    def _builtin_screen_clearscreen(self):
+        size = self.keyboard - self.screen
+        self.heap[self.screen:self.keyboard] = [0] * size
+        self.stack.append(0)
+
+    def _builtin_screen_setcolor(self):
+        color, = self._args(1)
+        self.color = bool(color)
+        self.stack.append(0)
+
+    def _builtin_screen_drawpixel(self):
+        x, y = self._args(2)
+        if not self._on_screen(x, y):
+            self._os_error(7)
+        self._draw_hline(x, x, y)
+        self.stack.append(0)
+
+    def _builtin_screen_drawline(self):
+        x1, y1, x2, y2 = self._args(4)
+        if (x1 < 0 or x2 >= self.screen_width
+                or y1 < 0 or y2 >= self.screen_height):
+            self._os_error(8)
+
+        # Bresenham along the longer axis, the same pixels as Screen.vm
+        dx, dy = abs(x2 - x1), abs(y2 - y1)
+        steep = dx < dy
+        if (steep and y2 < y1) or (not steep and x2 < x1):
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        if steep:
+            dx, dy = dy, dx
+            a, b, end, step = y1, x1, y2, -1 if x1 > x2 else 1
+        else:
+            a, b, end, step = x1, y1, x2, -1 if y1 > y2 else 1
+
+        diff = 2 * dy - dx
+        while True:
+            x, y = (b, a) if steep else (a, b)
+            if not self._on_screen(x, y):
+                self._os_error(7)
+            self._draw_hline(x, x, y)
+            if a >= end:
+                break
+            if diff < 0:
+                diff += 2 * dy
+            else:
+                diff += 2 * (dy - dx)
+                b += step
+            a += 1
+        self.stack.append(0)
+
+    def _builtin_screen_drawrectangle(self):
+        x1, y1, x2, y2 = self._args(4)
+        if (x1 > x2 or y1 > y2
+                or not (self._on_screen(x1, y1) and self._on_screen(x2, y2))):
+            self._os_error(9)
+        for y in range(y1, y2 + 1):
+            self._draw_hline(x1, x2, y)
+        self.stack.append(0)
+
+    def _builtin_screen_drawcircle(self):
+        x, y, r = self._args(3)
+        if not self._on_screen(x, y):
+            self._os_error(12)
+        if not (self._on_screen(x - r, y - r)
+                and self._on_screen(x + r, y + r)):
+            self._os_error(13)
+
+        # the midpoint algorithm, filling the symmetric octants
+        a, b, diff = 0, r, 1 - r
+        while True:
+            self._draw_hline(x - a, x + a, y - b)
+            self._draw_hline(x - a, x + a, y + b)
+            self._draw_hline(x - b, x + b, y - a)
+            self._draw_hline(x - b, x + b, y + a)
+            if b <= a:
+                break
+            if diff < 0:
+                diff += 2 * a + 3
+            else:
+                diff += 2 * (a - b) + 5
+                b -= 1
+            a += 1
+        self.stack.append(0)
+
+    def _on_screen(self, x, y):
+        return 0 <= x < self.screen_width and 0 <= y < self.screen_height
+
+    def _draw_hline(self, x1, x2, y):
+        # x1 <= x2, both ends are included
+        row = self.screen + y * 32
+        for word in range(x1 // 16, x2 // 16 + 1):
+            first = max(x1, word * 16) % 16
+            last = min(x2, word * 16 + 15) % 16
+            mask = ((1 << (last + 1)) - 1) ^ ((1 << first) - 1)
+            if self.color:
+                value = self.heap[row + word] | mask
+            else:
+                value = self.heap[row + word] & ~mask
+            self.heap[row + word] = to_int16(value)
+
+    #
+    # Keyboard, the rest of it waits for the input and runs from Keyboard.vm
+    #
+    def _builtin_keyboard_init(self):
+        self.stack.append(0)
+
+    def _builtin_keyboard_keypressed(self):
+        self.stack.append(self.heap[self.keyboard])
+
+    #
+    # Sys, Sys.init runs from Sys.vm, since it calls into the program
+    #
+    def _builtin_sys_halt(self):
+        self.pc = len(self.code)
+
+    def _builtin_sys_error(self):
+        code, = self._args(1)
+        self._os_error(code)
+
+    def _builtin_sys_wait(self):
+        duration, = self._args(1)
+        if duration < 0:
+            self._os_error(1)
+        self.stack.append(0)
+
+
+font = {
+    0: (63, 63, 63, 63, 63, 63, 63, 63, 63, 0, 0),  # black square
+    32: (0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),  # space
+    33: (12, 30, 30, 30, 12, 12, 0, 12, 12, 0, 0),  # !
+    34: (54, 54, 20, 0, 0, 0, 0, 0, 0, 0, 0),  # "
+    35: (0, 18, 18, 63, 18, 18, 63, 18, 18, 0, 0),  # #
+    36: (12, 30, 51, 3, 30, 48, 51, 30, 12, 12, 0),  # $
+    37: (0, 0, 35, 51, 24, 12, 6, 51, 49, 0, 0),  # %
+    38: (12, 30, 30, 12, 54, 27, 27, 27, 54, 0, 0),  # &
+    39: (12, 12, 6, 0, 0, 0, 0, 0, 0, 0, 0),  # '
+    40: (24, 12, 6, 6, 6, 6, 6, 12, 24, 0, 0),  # (
+    41: (6, 12, 24, 24, 24, 24, 24, 12, 6, 0, 0),  # )
+    42: (0, 0, 0, 51, 30, 63, 30, 51, 0, 0, 0),  # *
+    43: (0, 0, 0, 12, 12, 63, 12, 12, 0, 0, 0),  # +
+    44: (0, 0, 0, 0, 0, 0, 0, 12, 12, 6, 0),  # ,
+    45: (0, 0, 0, 0, 0, 63, 0, 0, 0, 0, 0),  # -
+    46: (0, 0, 0, 0, 0, 0, 0, 12, 12, 0, 0),  # .
+    47: (0, 0, 32, 48, 24, 12, 6, 3, 1, 0, 0),  # /
+    48: (12, 30, 51, 51, 51, 51, 51, 30, 12, 0, 0),  # 0
+    49: (12, 14, 15, 12, 12, 12, 12, 12, 63, 0, 0),  # 1
+    50: (30, 51, 48, 24, 12, 6, 3, 51, 63, 0, 0),  # 2
+    51: (30, 51, 48, 48, 28, 48, 48, 51, 30, 0, 0),  # 3
+    52: (16, 24, 28, 26, 25, 63, 24, 24, 60, 0, 0),  # 4
+    53: (63, 3, 3, 31, 48, 48, 48, 51, 30, 0, 0),  # 5
+    54: (28, 6, 3, 3, 31, 51, 51, 51, 30, 0, 0),  # 6
+    55: (63, 49, 48, 48, 24, 12, 12, 12, 12, 0, 0),  # 7
+    56: (30, 51, 51, 51, 30, 51, 51, 51, 30, 0, 0),  # 8
+    57: (30, 51, 51, 51, 62, 48, 48, 24, 14, 0, 0),  # 9
+    58: (0, 0, 12, 12, 0, 0, 12, 12, 0, 0, 0),  # :
+    59: (0, 0, 12, 12, 0, 0, 12, 12, 6, 0, 0),  # ;
+    60: (0, 0, 24, 12, 6, 3, 6, 12, 24, 0, 0),  # <
+    61: (0, 0, 0, 63, 0, 0, 63, 0, 0, 0, 0),  # =
+    62: (0, 0, 3, 6, 12, 24, 12, 6, 3, 0, 0),  # >
+    63: (30, 51, 51, 24, 12, 12, 0, 12, 12, 0, 0),  # ?
+    64: (30, 51, 51, 59, 59, 59, 27, 3, 30, 0, 0),  # @
+    65: (12, 30, 51, 51, 63, 51, 51, 51, 51, 0, 0),  # A
+    66: (31, 51, 51, 51, 31, 51, 51, 51, 31, 0, 0),  # B
+    67: (28, 54, 35, 3, 3, 3, 35, 54, 28, 0, 0),  # C
+    68: (15, 27, 51, 51, 51, 51, 51, 27, 15, 0, 0),  # D
+    69: (63, 51, 35, 11, 15, 11, 35, 51, 63, 0, 0),  # E
+    70: (63, 51, 35, 11, 15, 11, 3, 3, 3, 0, 0),  # F
+    71: (28, 54, 35, 3, 59, 51, 51, 54, 44, 0, 0),  # G
+    72: (51, 51, 51, 51, 63, 51, 51, 51, 51, 0, 0),  # H
+    73: (30, 12, 12, 12, 12, 12, 12, 12, 30, 0, 0),  # I
+    74: (60, 24, 24, 24, 24, 24, 27, 27, 14, 0, 0),  # J
+    75: (51, 51, 51, 27, 15, 27, 51, 51, 51, 0, 0),  # K
+    76: (3, 3, 3, 3, 3, 3, 35, 51, 63, 0, 0),  # L
+    77: (33, 51, 63, 63, 51, 51, 51, 51, 51, 0, 0),  # M
+    78: (51, 51, 55, 55, 63, 59, 59, 51, 51, 0, 0),  # N
+    79: (30, 51, 51, 51, 51, 51, 51, 51, 30, 0, 0),  # O
+    80: (31, 51, 51, 51, 31, 3, 3, 3, 3, 0, 0),  # P
+    81: (30, 51, 51, 51, 51, 51, 63, 59, 30, 48, 0),  # Q
+    82: (31, 51, 51, 51, 31, 27, 51, 51, 51, 0, 0),  # R
+    83: (30, 51, 51, 6, 28, 48, 51, 51, 30, 0, 0),  # S
+    84: (63, 63, 45, 12, 12, 12, 12, 12, 30, 0, 0),  # T
+    85: (51, 51, 51, 51, 51, 51, 51, 51, 30, 0, 0),  # U
+    86: (51, 51, 51, 51, 51, 30, 30, 12, 12, 0, 0),  # V
+    87: (51, 51, 51, 51, 51, 63, 63, 63, 18, 0, 0),  # W
+    88: (51, 51, 30, 30, 12, 30, 30, 51, 51, 0, 0),  # X
+    89: (51, 51, 51, 51, 30, 12, 12, 12, 30, 0, 0),  # Y
+    90: (63, 51, 49, 24, 12, 6, 35, 51, 63, 0, 0),  # Z
+    91: (30, 6, 6, 6, 6, 6, 6, 6, 30, 0, 0),  # [
+    92: (0, 0, 1, 3, 6, 12, 24, 48, 32, 0, 0),  # \
+    93: (30, 24, 24, 24, 24, 24, 24, 24, 30, 0, 0),  # ]
+    94: (8, 28, 54, 0, 0, 0, 0, 0, 0, 0, 0),  # ^
+    95: (0, 0, 0, 0, 0, 0, 0, 0, 0, 63, 0),  # _
+    96: (6, 12, 24, 0, 0, 0, 0, 0, 0, 0, 0),  # `
+    97: (0, 0, 0, 14, 24, 30, 27, 27, 54, 0, 0),  # a
+    98: (3, 3, 3, 15, 27, 51, 51, 51, 30, 0, 0),  # b
+    99: (0, 0, 0, 30, 51, 3, 3, 51, 30, 0, 0),  # c
+    100: (48, 48, 48, 60, 54, 51, 51, 51, 30, 0, 0),  # d
+    101: (0, 0, 0, 30, 51, 63, 3, 51, 30, 0, 0),  # e
+    102: (28, 54, 38, 6, 15, 6, 6, 6, 15, 0, 0),  # f
+    103: (0, 0, 30, 51, 51, 51, 62, 48, 51, 30, 0),  # g
+    104: (3, 3, 3, 27, 55, 51, 51, 51, 51, 0, 0),  # h
+    105: (12, 12, 0, 14, 12, 12, 12, 12, 30, 0, 0),  # i
+    106: (48, 48, 0, 56, 48, 48, 48, 48, 51, 30, 0),  # j
+    107: (3, 3, 3, 51, 27, 15, 15, 27, 51, 0, 0),  # k
+    108: (14, 12, 12, 12, 12, 12, 12, 12, 30, 0, 0),  # l
+    109: (0, 0, 0, 29, 63, 43, 43, 43, 43, 0, 0),  # m
+    110: (0, 0, 0, 29, 51, 51, 51, 51, 51, 0, 0),  # n
+    111: (0, 0, 0, 30, 51, 51, 51, 51, 30, 0, 0),  # o
+    112: (0, 0, 0, 30, 51, 51, 51, 31, 3, 3, 0),  # p
+    113: (0, 0, 0, 30, 51, 51, 51, 62, 48, 48, 0),  # q
+    114: (0, 0, 0, 29, 55, 51, 3, 3, 7, 0, 0),  # r
+    115: (0, 0, 0, 30, 51, 6, 24, 51, 30, 0, 0),  # s
+    116: (4, 6, 6, 15, 6, 6, 6, 54, 28, 0, 0),  # t
+    117: (0, 0, 0, 27, 27, 27, 27, 27, 54, 0, 0),  # u
+    118: (0, 0, 0, 51, 51, 51, 51, 30, 12, 0, 0),  # v
+    119: (0, 0, 0, 51, 51, 51, 63, 63, 18, 0, 0),  # w
+    120: (0, 0, 0, 51, 30, 12, 12, 30, 51, 0, 0),  # x
+    121: (0, 0, 0, 51, 51, 51, 62, 48, 24, 15, 0),  # y
+    122: (0, 0, 0, 63, 27, 12, 6, 51, 63, 0, 0),  # z
+    123: (56, 12, 12, 12, 7, 12, 12, 12, 56, 0, 0),  # {
+    124: (12, 12, 12, 12, 12, 12, 12, 12, 12, 0, 0),  # |
+    125: (7, 12, 12, 12, 56, 12, 12, 12, 7, 0, 0),  # }
+    126: (38, 45, 25, 0, 0, 0, 0, 0, 0, 0, 0),  # ~
+}
@@ -1,25 +1,124 @@
 #! /bin/env python3
 
 import argparse
+import difflib
+import os
+import pickle
 import signal
+import subprocess
 import sys
 
 from translator import Translator
 
 
+def other_hash_seed():
+    # a hash seed other than the one of this interpreter
+    seed = os.environ.get('PYTHONHASHSEED', '')
+    return str((int(seed) + 1) % 2**32) if seed.isdigit() else '1'
+
+
+def translate_fresh(path, options):
+    # the code blocks of the path translated by a new interpreter with
+    # another hash seed: the object ids and the order of the sets and dicts
+    # differ
+    result = subprocess.run(
+        [sys.executable, '-c',
+            'import VMTranslator; VMTranslator._translate_pickled()'],
+        input=pickle.dumps((os.path.abspath(path), options)),
+        capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, PYTHONHASHSEED=other_hash_seed()))
+    if result.returncode:
+        raise RuntimeError(result.stderr.decode().strip())
+    return pickle.loads(result.stdout)
+
+
+def _translate_pickled():
+    # the other end of translate_fresh
+    path, options = pickle.load(sys.stdin.buffer)
+    pickle.dump(list(Translator(**options).itranslate(path)),
+        sys.stdout.buffer)
+
+
+def check(path, options):
+    # translates here and in a new interpreter, nothing is written
+    first = list(Translator(**options).itranslate(path))
+    second = translate_fresh(path, options)
+    if first != second:
+        first, second = ('\n'.join(blocks).split('\n')
+            for blocks in (first, second))
+        for line in difflib.unified_diff(first, second, path,
+                f'{path} (new interpreter)', lineterm=''):
+            print(line, file=sys.stderr)
+        sys.exit(1)
+    print(f'check: {path} reproducible', file=sys.stderr)
+
+
 def main(args):
-    t = Translator()
+    options = dict(
+        stack_cache=args.stack_cache or args.optimize,
+        shared_calls=args.shared_calls or args.optimize,
+        shared_compare=args.shared_compare or args.optimize,
+    )
+    prune = args.prune or args.optimize
+    if args.check:
+        check(args.input, dict(prune=prune, jobs=args.jobs, **options))
+        return
+    t = Translator(prune=prune, jobs=args.jobs, **options)
     t.translate(args.input, dry_run=args.dry_run)
+    if args.report:
+        if prune:
+            print(f'linked {len(t.linked)} of {len(t.functions)} functions',
+                file=sys.stderr)
+        report = f'{t.instructions} instructions'
+        if prune or any(options.values()):
+            plain = Translator()
+            plain.translate(args.input, dry_run=True)
+            saved = 1 - t.instructions / plain.instructions
+            report = (f'{plain.instructions} -> {report}'
+                f' ({saved:.1%} fewer)')
+        print(report, file=sys.stderr)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='a Hack assembler',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('input', help='input files or directory')
+    parser.add_argument('input',
+        help='input file or directory; - reads the VM code from stdin and'
+            ' writes the assembly to stdout')
     parser.add_argument('--dry-run', '-d', action='store_true',
         help='do not create the output file.')
+    parser.add_argument('--check', action='store_true',
+        help='translate twice, the second time in a new interpreter with'
+            ' another hash seed, and report the differences, without'
+            ' creating the output file')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+        help='number of files of a directory to translate in parallel')
+    parser.add_argument('--stack-cache', action='store_true',
+        help='keep the top of the stack in D across adjacent commands')
+    parser.add_argument('--shared-calls', action='store_true',
+        help='save and restore the call frames in a single shared routine'
+            ' instead of at every call and return')
+    parser.add_argument('--shared-compare', action='store_true',
+        help='jump to a single copy of the eq, gt and lt code')
+    parser.add_argument('--prune', action='store_true',
+        help='translating a directory, leave out the functions that are'
+            ' never called from Sys.init')
+    parser.add_argument('--optimize', '-O', action='store_true',
+        help='all of the above')
+    parser.add_argument('--report', '-r', action='store_true',
+        help='print the number of emitted instructions, when optimizing'
+            ' also the number without optimizations')
 
     parsed_args = parser.parse_args()
+    if parsed_args.check and parsed_args.input == '-':
+        parser.error('--check reads the input twice, it needs a file')
+    optimizing = (parsed_args.optimize or parsed_args.prune
+        or parsed_args.stack_cache or parsed_args.shared_calls
+        or parsed_args.shared_compare)
+    if parsed_args.report and optimizing and parsed_args.input == '-':
+        # the unoptimized count comes from a second translation
+        parser.error('--report with optimizations reads the input twice,'
+            ' it needs a file')
 
     try:
         main(parsed_args)
@@ -0,0 +1,49 @@
+#! /bin/env python3
+
+import argparse
+import os
+import signal
+import sys
+import time
+
+from translator import Translator
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+os_dir = os.path.join(root, 'tools', 'OS')
+
+option_sets = {
+    'plain': {},
+    'optimized': dict(prune=True, stack_cache=True, shared_calls=True,
+        shared_compare=True),
+}
+
+
+def main(args):
+    for name, options in option_sets.items():
+        best = None
+        for _ in range(args.repeat):
+            t = Translator(**options)
+            started = time.perf_counter()
+            t.translate(args.directory, dry_run=True)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print(f'{name:10} {best * 1000:7.1f}ms'
+            f' {t.instructions / best:12,.0f} instructions/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VM translator benchmark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=os_dir,
+        help='directory with .vm files (default: tools/OS)')
+    parser.add_argument('--repeat', '-n', type=int, default=10,
+        help='number of translations, the fastest is reported')
+
+    parsed_args = parser.parse_args()
+
+    try:
+        main(parsed_args)
+    except BrokenPipeError:
+        sys.exit(128 + signal.SIGPIPE)
+    except KeyboardInterrupt:
+        sys.exit(128 + signal.SIGINT)
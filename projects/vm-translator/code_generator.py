@@ -1,28 +1,63 @@
-import re
+import functools
 
 import keywords as kw
 
 
+# the comp of `x op y` with x in D and y in A or M
+_binary_comps = {
+    'add': 'D+{}',
+    'sub': 'D-{}',
+    'and': 'D&{}',
+    'or': 'D|{}',
+}
+
+
+# where the ops put the number that makes their labels unique, e.g.
+# `(__EQ_END.{_n}__)` or `@{function}$ret.{_n}`
+_n = '\0'
+
+
+@functools.lru_cache(maxsize=4096)
+def _template(text):
+    # the code of an op without blank lines and indentation, split at its
+    # label numbers; the ops mostly generate the same few texts, so each is
+    # parsed once
+    lines = filter(bool, map(str.strip, text.split('\n')))
+    return tuple('\n'.join(lines).split(_n))
+
+
 class _Ops:
-    def __init__(self, filename=None):
+    # with stack_cache the top of the stack may live in D instead of RAM:
+    # the `_cached_*` ops take and leave it there when they can, every
+    # other op first writes it back (`flush`). With shared_calls the call
+    # sites and returns jump to a single copy of the frame save and
+    # restore code, with shared_compare eq, gt and lt call a single copy
+    # of their code.
+    #
+    # A `separate` file is translated on its own and linked with others:
+    # its generated labels are scoped by the file name and the shared
+    # routines it uses (`used_routines`) are left to the linker.
+    def __init__(self, filename=None, stack_cache=False, shared_calls=False,
+            shared_compare=False, separate=False):
         self.filename = filename
         self.function_name = None
+        self.stack_cache = stack_cache
+        self.shared_calls = shared_calls
+        self.shared_compare = shared_compare
+        self.separate = separate
+        self.used_routines = set()
         self.__idx = 0
+        self.__cached = False
+        self.__shared_emitted = set()
 
     def __format(self, text):
-        lines = filter(bool, map(str.strip, text.split('\n')))
-
-        def enumerate_labels(command):
-            # @__XXX__ [// comment]
-            if re.match(r'@__[^\s]+__(\s*//.*)?', command):
-                return re.sub(r'@__([^s]+)__', fr'@__\1.{self.__idx}__', command)
-            # (__XXX__) [// comment]
-            if re.match(r'\(__[^\s]+__\)(\s*//.*)?', command):
-                return re.sub(r'\(__([^s]+)__\)', fr'(__\1.{self.__idx}__)', command)
-            return command
-        lines = map(enumerate_labels, lines)
-
-        return '\n'.join(lines)
+        suffix = self.__idx
+        if self.separate:
+            suffix = f'{self.filename}.{suffix}'
+        chunks = _template(text)
+        if len(chunks) == 1:
+            return chunks[0]
+        return str(suffix).join(chunks)
 
     def __move_to_stack_top(self):
         return f'''
@@ -52,18 +87,36 @@ class _Ops:
 
     def __call__(self, op, *args):
         self.__idx += 1
-        op = getattr(self, f'_{op}'.replace('-', '_'))
-        return self.__format(op(*args))
+        name = op.replace('-', '_')
+        if self.stack_cache:
+            cached = getattr(self, f'_cached_{name}', None)
+            if cached is not None:
+                return self.__format(cached(*args))
+            code = getattr(self, f'_{name}')(*args)
+            return self.__format(self.flush() + code)
+        return self.__format(getattr(self, f'_{name}')(*args))
+
+    def flush(self):
+        # push the top of the stack cached in D
+        if not self.__cached:
+            return ''
+        self.__cached = False
+        return f'''
+            {self.__inc_stack_size_and_move_on_top()}
+            M=D
+        '''
+
+    def _cached_flush(self):
+        return self.flush()
 
     def init_program(self):
-        code = f'''
+        code = '''
             @256
             D=A
             @SP
             M=D
-            {self("call", "Sys.init", 0)}
         '''
-        return self.__format(code)
+        return self.__format(code) + '\n' + self("call", "Sys.init", 0)
 
     def _add(self):
         return f'''
@@ -93,20 +146,25 @@ class _Ops:
         '''
 
     def _eq(self):
+        if self.shared_compare:
+            return self.__compare('eq')
+        return self.__eq()
+
+    def __eq(self):
         return f'''
             // eq
             {self.__move_to_stack_top()}
             D=M
             A=A-1
             D=D-M
-            @__EQ_TRUE__
+            @__EQ_TRUE.{_n}__
             D; JEQ
             D=0
-            @__EQ_END__
+            @__EQ_END.{_n}__
             0; JMP
-            (__EQ_TRUE__)
+            (__EQ_TRUE.{_n}__)
             D=-1
-            (__EQ_END__)
+            (__EQ_END.{_n}__)
             {self.__dec_stack_size_and_move_on_top()}
             M=D
         '''
@@ -115,68 +173,101 @@ class _Ops:
         return f'''
             {self.__move_to_stack_top()}
             D=M
-            @__{prefix}_NEG_Y__
+            @__{prefix}_NEG_Y.{_n}__
             D; JLT
 
             // y >= 0
             {self.__move_to_stack_top()}
             A=A-1
             D=M
-            @__{prefix}_CHECK_DIFF__
+            @__{prefix}_CHECK_DIFF.{_n}__
             D; JGE
 
             // x < 0 & y >= 0
-            @__{prefix}_{"TRUE" if lt else "FALSE"}__
+            @__{prefix}_{"TRUE" if lt else "FALSE"}.{_n}__
             0; JMP
             
-            (__{prefix}_FALSE__)
+            (__{prefix}_FALSE.{_n}__)
             D=0
-            @__{prefix}_END__
+            @__{prefix}_END.{_n}__
             0; JMP
 
-            (__{prefix}_NEG_Y__)
+            (__{prefix}_NEG_Y.{_n}__)
             // y < 0
             {self.__move_to_stack_top()}
             A=A-1
             D=M
-            @__{prefix}_CHECK_DIFF__
+            @__{prefix}_CHECK_DIFF.{_n}__
             D; JLT
 
             // x >= 0 & y < 0
-            @__{prefix}_{"FALSE" if lt else "TRUE"}__
+            @__{prefix}_{"FALSE" if lt else "TRUE"}.{_n}__
             0; JMP
 
-            (__{prefix}_TRUE__)
+            (__{prefix}_TRUE.{_n}__)
             D=-1
-            @__{prefix}_END__
+            @__{prefix}_END.{_n}__
             0; JMP
 
-            (__{prefix}_CHECK_DIFF__)
+            (__{prefix}_CHECK_DIFF.{_n}__)
             // D=x; (x < 0 & y < 0) | (x >= 0 | y >= 0)
             {self.__move_to_stack_top()}
             D=D-M
-            @__{prefix}_TRUE__
+            @__{prefix}_TRUE.{_n}__
             D; {"JLT" if lt else "JGT"}
-            @__{prefix}_FALSE__
+            @__{prefix}_FALSE.{_n}__
             0; JMP
 
-            (__{prefix}_END__)
+            (__{prefix}_END.{_n}__)
             {self.__dec_stack_size_and_move_on_top()}
             M=D
         '''
 
     def _gt(self):
+        if self.shared_compare:
+            return self.__compare('gt')
         return f'''
             // gt
             {self.__cmp_ne("GT", lt=False)}
         '''
 
     def _lt(self):
+        if self.shared_compare:
+            return self.__compare('lt')
         return f'''
             // lt
             {self.__cmp_ne("LT", lt=True)}
         '''
 
+    def __compare(self, op):
+        # jump to the shared routine with the return address in D
+        return f'''
+            // {op}
+            {self.__shared(op)}
+            @__{op.upper()}_RETURN.{_n}__
+            D=A
+            @$${op}
+            0; JMP
+            (__{op.upper()}_RETURN.{_n}__)
+        '''
+
+    def __compare_routine(self, op):
+        compare = {
+            'eq': self.__eq,
+            'gt': lambda: self.__cmp_ne("GT", lt=False),
+            'lt': lambda: self.__cmp_ne("LT", lt=True),
+        }[op]
+        return f'''
+            // {op}: D = return address
+            ($${op})
+            @R15
+            M=D
+            {compare()}
+            @R15
+            A=M
+            0; JMP
+        '''
+
     def _and(self):
         return f'''
             // and
@@ -205,6 +296,15 @@ class _Ops:
         '''
 
     def _push(self, segment, value):
+        return f'''
+            // push
+            {self.__read_value(segment, value)}
+            {self.__inc_stack_size_and_move_on_top()}
+            M=D
+        '''
+
+    def __read_value(self, segment, value):
+        # D = segment[value]
         if segment == 'static':
             read_value = f'''
                 @{self.filename}.{value}
@@ -233,14 +333,168 @@ class _Ops:
             '''
         else:
             raise NotImplementedError(f'push {segment}')
+        return read_value
 
-        return f'''
-            // push
+    def __address(self, segment, value):
+        # A = the address of segment[value] without touching D, None when
+        # that takes more than a few instructions
+        if segment == 'static':
+            return f'@{self.filename}.{value}'
+        if segment in kw.special_segmnets:
+            return f'@{kw.constants[kw.special_segmnets[segment]] + value}'
+        if segment in kw.segment_pointers and value <= 3:
+            return '\n'.join([f'@{kw.segment_pointers[segment]}', 'A=M']
+                + ['A=A+1'] * value)
+        return None
+
+    def _cached_push(self, segment, value):
+        address = self.__address(segment, value)
+        if segment == 'constant':
+            read_value = f'''
+                @{value}
+                D=A
+            '''
+        elif address is not None:
+            read_value = f'''
+                {address}
+                D=M
+            '''
+        else:
+            read_value = self.__read_value(segment, value)
+        code = f'''
+            {self.flush()}
+            // push {segment} {value}
             {read_value}
-            {self.__inc_stack_size_and_move_on_top()}
+        '''
+        self.__cached = True
+        return code
+
+    def _cached_pop(self, segment, value):
+        if not self.__cached:
+            return self._pop(segment, value)
+        self.__cached = False
+
+        address = self.__address(segment, value)
+        if address is not None:
+            return f'''
+                // pop {segment} {value}
+                {address}
+                M=D
+            '''
+        return f'''
+            // pop {segment} {value}
+            @R13
+            M=D
+            @{kw.segment_pointers[segment]}
+            D=M
+            @{value}
+            D=D+A
+            @R14
+            M=D
+            @R13
+            D=M
+            @R14
+            A=M
             M=D
         '''
 
+    def __pop_to_d(self):
+        # D = the top of the stack, taken from D or RAM
+        if self.__cached:
+            return ''
+        self.__cached = True
+        return '''
+            @SP
+            AM=M-1
+            D=M
+        '''
+
+    def __cached_binary(self, op, comp):
+        # x op y with y in D, the result stays in D
+        return f'''
+            // {op}
+            {self.__pop_to_d()}
+            @SP
+            AM=M-1
+            D={comp}
+        '''
+
+    def _cached_add(self):
+        return self.__cached_binary('add', 'D+M')
+
+    def _cached_sub(self):
+        return self.__cached_binary('sub', 'M-D')
+
+    def _cached_and(self):
+        return self.__cached_binary('and', 'D&M')
+
+    def _cached_or(self):
+        return self.__cached_binary('or', 'D|M')
+
+    def _cached_push_binary(self, segment, value, op):
+        # push segment[value]; op: the second operand goes straight from
+        # its address (or constant) into the comp, x is moved to D
+        if segment == 'constant':
+            operand = f'@{value}'
+            comp = _binary_comps[op].format('A')
+        else:
+            operand = self.__address(segment, value)
+            comp = _binary_comps[op].format('M')
+        return f'''
+            // push {segment} {value}; {op}
+            {self.__pop_to_d()}
+            {operand}
+            D={comp}
+        '''
+
+    def _cached_neg(self):
+        if not self.__cached:
+            return self._neg()
+        return '''
+            // neg
+            D=-D
+        '''
+
+    def _cached_not(self):
+        if not self.__cached:
+            return self._not()
+        return '''
+            // not
+            D=!D
+        '''
+
+    def _cached_eq(self):
+        if not self.__cached:
+            return self._eq()
+        return f'''
+            // eq
+            @SP
+            AM=M-1
+            D=M-D
+            @__EQ_TRUE.{_n}__
+            D; JEQ
+            D=0
+            @__EQ_END.{_n}__
+            0; JMP
+            (__EQ_TRUE.{_n}__)
+            D=-1
+            (__EQ_END.{_n}__)
+        '''
+
+    def _cached_if_goto(self, label):
+        if not self.__cached:
+            return self._if_goto(label)
+        self.__cached = False
+        return f'''
+            // if-goto {label}
+            @{self.__label_name(label)}
+            D; JNE
+        '''
+
+    def can_push_binary(self, segment, value):
+        return (segment == 'constant'
+            or self.__address(segment, value) is not None)
+
     def _pop(self, segment, value):
         assert segment != 'constant'
 
@@ -322,21 +576,31 @@ class _Ops:
             @R13
             M=D
 
-            (__FN_ZERO_LOCAL__)  // while D > 0
-            @__FN_START__
+            (__FN_ZERO_LOCAL.{_n}__)  // while D > 0
+            @__FN_START.{_n}__
             D; JEQ  // D = R13
             {self.__inc_stack_size_and_move_on_top()}
             M=0
             @R13
             M=M-1
             D=M
-            @__FN_ZERO_LOCAL__
+            @__FN_ZERO_LOCAL.{_n}__
             0; JMP
 
-            (__FN_START__)
+            (__FN_START.{_n}__)
         '''
 
     def _return(self):
+        if not self.shared_calls:
+            return self.__return_sequence()
+        return f'''
+            // return
+            {self.__shared('calls')}
+            @$$return
+            0; JMP
+        '''
+
+    def __return_sequence(self):
         def restore(ptr):
             return f'''
                 // *{ptr} = *(--LCL)
@@ -383,33 +647,114 @@ class _Ops:
             0; JMP
         '''
 
-    def _call(self, function, n_args):
-        i = self.__idx
-        self.__idx += 1
-
-        def push(ptr):
-            return f'''
-                @{ptr}
-                D=M
-                {self.__inc_stack_size_and_move_on_top()}
-                M=D
-            '''
+    def __push_register(self, ptr):
+        return f'''
+            @{ptr}
+            D=M
+            {self.__inc_stack_size_and_move_on_top()}
+            M=D
+        '''
 
+    def __save_frame(self):
+        # D = the return address
         return f'''
-            // call {function} {n_args}
-            @{function}$ret.{i}
-            D=A
             {self.__inc_stack_size_and_move_on_top()}
             M=D      // 1. push return address
 
             // 2. push LCL
-            {push("LCL")}
+            {self.__push_register("LCL")}
             // 3. push ARG
-            {push("ARG")}
+            {self.__push_register("ARG")}
             // 4. push THIS
-            {push("THIS")}
+            {self.__push_register("THIS")}
             // 5. push THAT
-            {push("THAT")}
+            {self.__push_register("THAT")}
+        '''
+
+    def __shared(self, name):
+        # the shared routines are emitted (and jumped over) at their first
+        # use
+        self.used_routines.add(name)
+        if name in self.__shared_emitted or self.separate:
+            return ''
+        self.__shared_emitted.add(name)
+        if name == 'calls':
+            routine = self.__call_routines()
+        else:
+            routine = self.__compare_routine(name)
+        return f'''
+            @$${name}.end
+            0; JMP
+            {routine}
+            ($${name}.end)
+        '''
+
+    def routines(self, names):
+        # the shared routines not emitted yet
+        return self.__format(''.join(self.__shared(name)
+            for name in sorted(names)))
+
+    def __call_routines(self):
+        return f'''
+            // call: D = return address, R13 = n_args, R14 = function
+            ($$call)
+            {self.__save_frame()}
+            @SP
+            D=M
+            @R13
+            D=D-M
+            @5
+            D=D-A
+            @ARG
+            M=D      // 6. ARG = SP - n_args - 5
+
+            @SP
+            D=M
+            @LCL
+            M=D      // 7. LCL = SP
+
+            @R14
+            A=M
+            0; JMP   // 8. goto function
+
+            ($$return)
+            {self.__return_sequence()}
+        '''
+
+    def _call(self, function, n_args):
+        if self.shared_calls:
+            if n_args in (0, 1):
+                set_n_args = f'''
+                    @R13
+                    M={n_args}
+                '''
+            else:
+                set_n_args = f'''
+                    @{n_args}
+                    D=A
+                    @R13
+                    M=D
+                '''
+            return f'''
+                // call {function} {n_args}
+                {self.__shared('calls')}
+                {set_n_args}
+                @{function}
+                D=A
+                @R14
+                M=D
+                @{function}$ret.{_n}
+                D=A
+                @$$call
+                0; JMP
+                ({function}$ret.{_n})
+            '''
+
+        return f'''
+            // call {function} {n_args}
+            @{function}$ret.{_n}
+            D=A
+            {self.__save_frame()}
 
             @SP
             D=M
@@ -427,13 +772,14 @@ class _Ops:
 
             @{function}
             0; JMP   // 8. goto function
-            ({function}$ret.{i})
+            ({function}$ret.{_n})
         '''
 
 
 class CodeGenerator:
-    def __init__(self):
-        self.__ops = _Ops()
+    def __init__(self, **options):
+        # see _Ops for the options
+        self.__ops = _Ops(**options)
 
     def translate(self, filename, commands):
         code_blocks = self.itranslate(filename, commands)
@@ -445,9 +791,38 @@ class CodeGenerator:
 
         self.__ops.filename = filename
         commands = self.__detect_functions(commands)
+        if self.__ops.stack_cache:
+            commands = self.__fuse(commands)
         for function_name, command in commands:
             self.__ops.function_name = function_name
             yield self.__ops(*command[1:])
+        if self.__ops.stack_cache:
+            code = self.__ops('flush')
+            if code:
+                yield code
+
+    def __fuse(self, commands):
+        # `push x; add` (and sub, and, or) becomes a single push-binary
+        # command when x can be read without going through D
+        pending = None
+        for item in commands:
+            function_name, command = item
+            if pending is not None:
+                push = pending[1]
+                if command[1] in _binary_comps:
+                    yield function_name, (push[0], 'push-binary',
+                        push[2], push[3], command[1])
+                    pending = None
+                    continue
+                yield pending
+                pending = None
+            if command[1] == 'push' and self.__ops.can_push_binary(
+                    command[2], command[3]):
+                pending = item
+                continue
+            yield item
+        if pending is not None:
+            yield pending
 
     def __detect_functions(self, commands):
         command_buffer = []
@@ -502,3 +877,11 @@ class CodeGenerator:
 
     def gen_initializer(self):
         return self.__ops.init_program()
+
+    @property
+    def used_routines(self):
+        return self.__ops.used_routines
+
+    def gen_routines(self, names):
+        # the shared routines used by separately translated files
+        return self.__ops.routines(names)
@@ -37,7 +37,11 @@ class Parser:
 
 
     def parse(self, code):
-        for lineno, line in enumerate(code.splitlines()):
+        # code is a string or an iterable of lines, e.g. a file object, read
+        # a line at a time
+        if isinstance(code, str):
+            code = code.splitlines()
+        for lineno, line in enumerate(code):
             line = line.rstrip()
             line = line.split('//', 1)[0]
             line = line.lstrip()
@@ -53,4 +57,4 @@ class Parser:
 
     def parse_file(self, path):
         with open(path) as f:
-            yield from self.parse(f.read())
+            yield from self.parse(f)
@@ -1,13 +1,19 @@
+import itertools
+import os
+import re
+import shutil
 import pytest
 
 import keywords as kw
-from vm_emulator import VMEmulator
+from vm_emulator import VMEmulator, MaxStepsExceededError
 from code_generator import CodeGenerator
+from translator import Translator, count_instructions
 
 
-@pytest.fixture
-def vm():
-    return VMEmulator(trace=True)
+@pytest.fixture(params=itertools.product(VMEmulator.engines, VMEmulator.rams))
+def vm(request):
+    engine, ram = request.param
+    return VMEmulator(trace=True, engine=engine, ram=ram)
 
 
 def test_push_constant(vm):
@@ -392,6 +398,48 @@ def test_add(vm):
     }
 
 
+@pytest.mark.parametrize('engine', VMEmulator.engines)
+def test_add_overflow_flat_ram(engine):
+    vm = VMEmulator(engine=engine, ram='flat')
+    vm.ram[vm.stack_offset + 0] = 32767
+    vm.ram[vm.stack_offset + 1] = 1
+    vm.ram[vm.symbols['SP']] += 2
+
+    g = CodeGenerator()
+    code = g.translate(commands=[
+            (0, 'add'),
+        ],
+        filename='<input>',
+    )
+    vm.execute(code, max_steps=100)
+
+    assert vm.ram == {
+        vm.symbols['SP']: vm.stack_offset + 1,
+        vm.stack_offset + 0: -32768,
+        vm.stack_offset + 1: 1,
+    }
+
+
+@pytest.mark.parametrize('engine', VMEmulator.engines)
+def test_wrapped_jump_flat_ram(engine):
+    # A = -32768 + 8 after the wraparound, the jump goes to 8
+    vm = VMEmulator(engine=engine, ram='flat')
+    vm.execute('''
+        @32767
+        D=A
+        D=D+1
+        @8
+        A=D+A
+        0; JMP
+        @100
+        M=1
+        @101
+        M=1
+    ''', max_steps=100)
+    assert 100 not in dict(vm.ram.items())
+    assert vm.ram[101] == 1
+
+
 def test_sub(vm):
     vm.ram[vm.stack_offset + 0] = 22
     vm.ram[vm.stack_offset + 1] = 33
@@ -503,12 +551,13 @@ def test_not(vm):
         (-1, 1, 0),
         (1, -1, -1),
     ])
-def test_gt(vm, a, b, expected):
+@pytest.mark.parametrize('shared_compare', [False, True])
+def test_gt(vm, a, b, expected, shared_compare):
     vm.ram[vm.stack_offset + 0] = a
     vm.ram[vm.stack_offset + 1] = b
     vm.ram[vm.symbols['SP']] += 2
 
-    g = CodeGenerator()
+    g = CodeGenerator(shared_compare=shared_compare)
     code = g.translate(commands=[
             (0, 'gt'),
         ],
@@ -539,12 +588,13 @@ def test_gt(vm, a, b, expected):
         (-1, 1, -1),
         (1, -1, 0),
     ])
-def test_lt(vm, a, b, expected):
+@pytest.mark.parametrize('shared_compare', [False, True])
+def test_lt(vm, a, b, expected, shared_compare):
     vm.ram[vm.stack_offset + 0] = a
     vm.ram[vm.stack_offset + 1] = b
     vm.ram[vm.symbols['SP']] += 2
 
-    g = CodeGenerator()
+    g = CodeGenerator(shared_compare=shared_compare)
     code = g.translate(commands=[
             (0, 'lt'),
         ],
@@ -566,12 +616,13 @@ def test_lt(vm, a, b, expected):
         (1, 1, -1),
         (2, 1, 0),
     ])
-def test_eq(vm, a, b, expected):
+@pytest.mark.parametrize('shared_compare', [False, True])
+def test_eq(vm, a, b, expected, shared_compare):
     vm.ram[vm.stack_offset + 0] = a
     vm.ram[vm.stack_offset + 1] = b
     vm.ram[vm.symbols['SP']] += 2
 
-    g = CodeGenerator()
+    g = CodeGenerator(shared_compare=shared_compare)
     code = g.translate(commands=[
             (0, 'eq'),
         ],
@@ -845,3 +896,255 @@ def test_program(vm):
     vm.execute(code, 500)
 
     assert vm.ram[vm.symbols['SP']] == vm.stack_offset + 1
+
+
+def _countdown(n):
+    g = CodeGenerator()
+    return g.translate(commands=[
+            (0, 'push', 'constant', n),
+            (1, 'pop', 'temp', 1),
+            (2, 'label', 'loop'),
+            (3, 'push', 'temp', 1),
+            (4, 'push', 'constant', 1),
+            (5, 'sub'),
+            (6, 'pop', 'temp', 1),
+            (7, 'push', 'temp', 1),
+            (8, 'push', 'constant', 0),
+            (9, 'gt'),
+            (10, 'if-goto', 'loop'),
+        ],
+        filename='<input>',
+    )
+
+
+def test_jit_blocks():
+    vm = VMEmulator(engine='jit')
+    vm.execute(_countdown(10), 5000)
+
+    assert vm.ram[vm.symbols['R6']] == 0
+    assert 0 < vm.blocks_compiled < vm.blocks_executed
+
+
+@pytest.mark.parametrize('max_steps', [1, 10, 100, 101, 333])
+def test_max_steps(max_steps):
+    code = _countdown(10)
+    pcs = set()
+    for engine in VMEmulator.engines:
+        vm = VMEmulator(engine=engine)
+        with pytest.raises(MaxStepsExceededError):
+            vm.execute(code, max_steps)
+        pcs.add(vm.pc)
+
+    assert len(pcs) == 1
+
+
+def _segments(vm):
+    for i, segment in enumerate(['LCL', 'ARG', 'THIS', 'THAT']):
+        vm.ram[vm.symbols[segment]] = 1000 + 100 * i
+
+
+def _observable(vm):
+    # the stack above SP is garbage
+    sp = vm.ram[vm.symbols['SP']]
+    return {address: value for address, value in vm.ram.items()
+        if not sp <= address < 1000}
+
+
+_stack_cache_programs = {
+    'arithmetic': [
+        (0, 'push', 'constant', 7),
+        (1, 'pop', 'local', 0),
+        (2, 'push', 'local', 0),
+        (3, 'push', 'constant', 5),
+        (4, 'add'),
+        (5, 'push', 'constant', 3),
+        (6, 'sub'),
+        (7, 'pop', 'local', 7),
+        (8, 'push', 'local', 7),
+        (9, 'push', 'local', 0),
+        (10, 'sub'),
+        (11, 'neg'),
+        (12, 'pop', 'static', 1),
+        (13, 'push', 'static', 1),
+        (14, 'push', 'static', 1),
+        (15, 'add'),
+        (16, 'push', 'argument', 5),
+        (17, 'push', 'local', 7),
+        (18, 'add'),
+        (19, 'or'),
+        (20, 'not'),
+        (21, 'push', 'constant', 12),
+        (22, 'and'),
+        (23, 'pop', 'temp', 2),
+        (24, 'push', 'local', 0),
+        (25, 'pop', 'pointer', 1),
+        (26, 'push', 'temp', 2),
+        (27, 'pop', 'that', 4),
+        (28, 'push', 'that', 4),
+        (29, 'push', 'local', 7),
+        (30, 'push', 'argument', 0),
+        (31, 'neg'),
+        (32, 'push', 'pointer', 1),
+    ],
+    'comparisons': [
+        (0, 'push', 'constant', 3),
+        (1, 'push', 'constant', 3),
+        (2, 'eq'),
+        (3, 'pop', 'local', 0),
+        (4, 'push', 'local', 0),
+        (5, 'push', 'constant', 4),
+        (6, 'eq'),
+        (7, 'push', 'constant', 4),
+        (8, 'push', 'constant', 3),
+        (9, 'gt'),
+        (10, 'push', 'constant', 4),
+        (11, 'push', 'constant', 3),
+        (12, 'lt'),
+        (13, 'pop', 'local', 3),
+        (14, 'pop', 'local', 2),
+        (15, 'pop', 'local', 1),
+        (16, 'push', 'local', 1),
+        (17, 'if-goto', 'skip'),
+        (18, 'push', 'constant', 1),
+        (19, 'pop', 'local', 4),
+        (20, 'label', 'skip'),
+        (21, 'push', 'local', 3),
+        (22, 'if-goto', 'end'),
+        (23, 'push', 'constant', 1),
+        (24, 'pop', 'local', 5),
+        (25, 'label', 'end'),
+    ],
+    'countdown': [
+        (0, 'push', 'constant', 10),
+        (1, 'pop', 'temp', 1),
+        (2, 'label', 'loop'),
+        (3, 'push', 'temp', 1),
+        (4, 'push', 'constant', 1),
+        (5, 'sub'),
+        (6, 'pop', 'temp', 1),
+        (7, 'push', 'temp', 1),
+        (8, 'push', 'constant', 0),
+        (9, 'gt'),
+        (10, 'if-goto', 'loop'),
+    ],
+    'calls': [
+        (0,  'call', 'main', 0),
+        (1,  'goto', 'end'),
+        (2,  'function', 'main', 0),
+        (3,  'push', 'constant', 10),
+        (4,  'push', 'constant', 20),
+        (5,  'call', 'double-sum', 2),
+        (6,  'return'),
+        (7,  'function', 'double-sum', 1),
+        (8,  'push', 'argument', 0),
+        (9,  'push', 'argument', 1),
+        (10, 'add'),
+        (11, 'pop', 'local', 0),
+        (12, 'push', 'local', 0),
+        (13, 'push', 'local', 0),
+        (14, 'add'),
+        (15, 'return'),
+        (16, 'label', 'end'),
+    ],
+}
+
+
+@pytest.mark.parametrize('program', _stack_cache_programs)
+def test_stack_cache(vm, program):
+    results = []
+    for stack_cache in (False, True):
+        vm.reset()
+        _segments(vm)
+        vm.ram[1105] = 9
+        g = CodeGenerator(stack_cache=stack_cache)
+        code = g.translate(commands=_stack_cache_programs[program],
+            filename='<input>')
+        vm.execute(code, 2000)
+        results.append((_observable(vm), code))
+
+    (plain, plain_code), (cached, cached_code) = results
+    assert cached == plain
+    assert count_instructions(cached_code) < count_instructions(plain_code)
+
+
+def _run_project_test(tmp_path, directory, options):
+    # runs the .tst script of projects/08 on the translated program, the
+    # budget of `repeat N { ticktock; }` is in clock cycles
+    source = os.path.join(os.path.dirname(__file__), '..', '08', directory)
+    name = os.path.basename(directory)
+    target = tmp_path / name
+    shutil.copytree(source, target)
+    # the single file tests run without the bootstrap code
+    path = target / f'{name}.vm'
+    if not path.exists():
+        path = target
+    translator = Translator(**options)
+    translator.translate(str(path))
+
+    vm = VMEmulator(engine='jit')
+    script = (target / f'{name}.tst').read_text()
+    for address, value in re.findall(r'set RAM\[(\d+)\] (-?\d+)', script):
+        vm.ram[int(address)] = int(value)
+    steps, = re.findall(r'repeat (\d+)', script)
+    try:
+        vm.execute((target / f'{name}.asm').read_text(), int(steps))
+    except MaxStepsExceededError:
+        pass
+
+    header, values = (target / f'{name}.cmp').read_text().split('\n')[:2]
+    addresses = re.findall(r'RAM\[(\d+)\]', header)
+    expected = [int(value) for value in values.split('|')[1:-1]]
+    return [vm.ram[int(address)] for address in addresses], expected, \
+        translator.instructions
+
+
+@pytest.mark.parametrize('directory', [
+    'ProgramFlow/BasicLoop',
+    'ProgramFlow/FibonacciSeries',
+    'FunctionCalls/SimpleFunction',
+    'FunctionCalls/NestedCall',
+    'FunctionCalls/FibonacciElement',
+    'FunctionCalls/StaticsTest',
+])
+@pytest.mark.parametrize('options', [
+    {},
+    {'shared_calls': True},
+    {'shared_compare': True},
+    {'shared_calls': True, 'shared_compare': True, 'stack_cache': True,
+        'prune': True},
+])
+def test_project_programs(tmp_path, directory, options):
+    ram, expected, _ = _run_project_test(tmp_path, directory, options)
+    assert ram == expected
+
+
+def test_shared_calls_are_smaller(tmp_path):
+    sizes = []
+    for shared_calls in (False, True):
+        _, _, size = _run_project_test(tmp_path / str(shared_calls),
+            'FunctionCalls/FibonacciElement', {'shared_calls': shared_calls})
+        sizes.append(size)
+    assert sizes[1] < sizes[0]
+
+
+def test_shared_compare(vm):
+    results = []
+    for shared_compare in (False, True):
+        vm.reset()
+        _segments(vm)
+        commands = []
+        for i, op in enumerate(['lt', 'gt', 'eq'] * 3):
+            commands += [
+                (0, 'push', 'constant', i),
+                (0, 'push', 'constant', 4),
+                (0, op),
+                (0, 'pop', 'local', i),
+            ]
+        g = CodeGenerator(shared_compare=shared_compare)
+        code = g.translate(commands=commands, filename='<input>')
+        vm.execute(code, 2000)
+        results.append((_observable(vm), count_instructions(code)))
+
+    (plain, plain_size), (shared, shared_size) = results
+    assert shared == plain
+    assert shared_size < plain_size
@@ -48,3 +48,16 @@ def test_function():
     assert len(commands) == 8
     assert commands[0] == [1, 'function', 'fn', 0]
     assert commands[7] == [9, 'call', 'fn', 2]
+
+
+def test_parse_lines_lazily():
+    read = []
+    def lines():
+        for line in ['push constant 1', 'push constant 2', 'add']:
+            read.append(line)
+            yield line + '\n'
+
+    commands = Parser().parse(lines())
+    assert next(commands) == [0, 'push', 'constant', 1]
+    assert read == ['push constant 1']
+    assert list(commands) == [[1, 'push', 'constant', 2], [2, 'add']]
@@ -0,0 +1,191 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import code_generator
+import VMTranslator
+from translator import Translator, reachable_functions, split_functions
+from vm_emulator import VMEmulator, MaxStepsExceededError
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / 'Sys.vm').write_text('''
+        function Sys.init 0
+        push constant 3
+        call Main.double 1
+        pop static 0
+        label halt
+        goto halt
+        function Sys.unused 0
+        call Main.unused 0
+        return
+    ''')
+    (tmp_path / 'Main.vm').write_text('''
+        function Main.double 0
+        push argument 0
+        call Main.add 1
+        return
+        function Main.add 0
+        push argument 0
+        push argument 0
+        add
+        return
+        function Main.unused 0
+        call Main.add 0
+        return
+    ''')
+    return tmp_path
+
+
+def run(path):
+    vm = VMEmulator(engine='jit')
+    with pytest.raises(MaxStepsExceededError):
+        vm.execute(path.read_text(), 2000)
+    return vm.ram[vm.symbols['Sys.0']]
+
+
+def test_split_functions():
+    commands = [
+        (0, 'push', 'constant', 0),
+        (1, 'function', 'f', 0),
+        (2, 'return'),
+        (3, 'function', 'g', 0),
+    ]
+    assert split_functions(commands) == [
+        (None, [commands[0]]),
+        ('f', commands[1:3]),
+        ('g', commands[3:]),
+    ]
+
+
+def test_reachable_functions():
+    files = [
+        ('a.vm', [('f', [(0, 'call', 'g', 0)]), ('h', [(1, 'call', 'f', 0)])]),
+        ('b.vm', [('g', [(2, 'call', 'f', 0), (3, 'call', 'x', 0)])]),
+    ]
+    assert reachable_functions(files, 'f') == {'f', 'g'}
+    assert reachable_functions(files, 'h') == {'f', 'g', 'h'}
+
+
+def test_prune(project):
+    sizes = []
+    for prune in (False, True):
+        t = Translator(prune=prune)
+        t.translate(str(project))
+        assert run(project / f'{project.name}.asm') == 6
+        sizes.append(t.instructions)
+
+    assert t.functions == {'Sys.init', 'Sys.unused', 'Main.double',
+        'Main.add', 'Main.unused'}
+    assert t.linked == {'Sys.init', 'Main.double', 'Main.add'}
+    assert sizes[1] < sizes[0]
+
+
+def test_prune_without_sys_init(project):
+    (project / 'Sys.vm').unlink()
+    t = Translator(prune=True)
+    t.translate(str(project))
+    assert t.linked == t.functions
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'prune': True, 'stack_cache': True, 'shared_calls': True,
+        'shared_compare': True},
+])
+def test_jobs(project, options):
+    (project / 'Math.vm').write_text('''
+        function Math.min 0
+        push argument 0
+        push argument 1
+        lt
+        if-goto first
+        push argument 1
+        return
+        label first
+        push argument 0
+        return
+    ''')
+    (project / 'Sys.vm').write_text('''
+        function Sys.init 0
+        push constant 3
+        call Main.double 1
+        push constant 5
+        call Math.min 2
+        push constant 1
+        push constant 1
+        eq
+        add
+        pop static 0
+        label halt
+        goto halt
+    ''')
+    outputs = []
+    for jobs in (1, 2, 3):
+        t = Translator(jobs=jobs, **options)
+        t.translate(str(project))
+        output = project / f'{project.name}.asm'
+        assert run(output) == 4
+        outputs.append(output.read_text())
+    assert outputs[0] == outputs[1] == outputs[2]
+
+
+def test_reproducible(project, tmp_path_factory):
+    # the same files written in the other order translate the same
+    other = tmp_path_factory.mktemp('other')
+    for path in sorted(project.glob('*.vm'), reverse=True):
+        (other / path.name).write_text(path.read_text())
+
+    t = Translator(prune=True, stack_cache=True, shared_compare=True)
+    first = list(t.itranslate(str(project)))
+    assert list(t.itranslate(str(project))) == first
+    assert list(t.itranslate(str(other))) == first
+
+
+def test_stdin(project, monkeypatch, capsys):
+    path = project / 'Main.vm'
+    Translator().translate(str(path))
+    monkeypatch.setattr('sys.stdin', io.StringIO(path.read_text()))
+    Translator().translate('-')
+    # the same code, but for the names of the statics and labels
+    expected = (project / 'Main.asm').read_text().replace('Main$', 'stdin$')
+    assert capsys.readouterr().out == expected
+
+
+@pytest.mark.parametrize('options, returncode', [([], 0), (['-O'], 2)])
+def test_stdin_report(options, returncode):
+    # the optimized report translates the input a second time without the
+    # optimizations, which stdin can not do
+    script = os.path.join(os.path.dirname(__file__), 'VMTranslator.py')
+    result = subprocess.run(
+        [sys.executable, script, '--report', *options, '-'],
+        input='push constant 1\npush constant 2\nadd\n',
+        capture_output=True, text=True)
+    assert result.returncode == returncode
+    if returncode:
+        assert 'needs a file' in result.stderr
+    else:
+        assert result.stderr.endswith(' instructions\n')
+        assert '@SP' in result.stdout
+
+
+def test_check(project, capsys):
+    # the second translation runs in a new interpreter: the code must not
+    # depend on id() or on the hash seed
+    VMTranslator.check(str(project), dict(prune=True, stack_cache=True,
+        shared_calls=True, shared_compare=True))
+    assert capsys.readouterr().err.endswith(' reproducible\n')
+
+
+def test_check_catches_id_labels(project, monkeypatch, capsys):
+    def id_format(self, text):
+        return str(id(self)).join(code_generator._template(text))
+
+    monkeypatch.setattr(code_generator._Ops, '_Ops__format', id_format)
+    with pytest.raises(SystemExit):
+        VMTranslator.check(str(project / 'Main.vm'), {})
+    assert '(new interpreter)' in capsys.readouterr().err
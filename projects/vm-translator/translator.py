@@ -1,13 +1,83 @@
 import os
+import sys
 import glob
+import itertools
 import contextlib
+import concurrent.futures
 
 from parser import Parser
 from code_generator import CodeGenerator
 
 
+def count_instructions(block):
+    # A- and C-instructions, without labels and comments
+    count = 0
+    for line in block.split('\n'):
+        line = line.split('//', 1)[0].strip()
+        if line and not line.startswith('('):
+            count += 1
+    return count
+
+
+def split_functions(commands):
+    # [(function name, its commands)], the commands before the first
+    # function come under None
+    functions = [(None, [])]
+    for command in commands:
+        if command[1] == 'function':
+            functions.append((command[2], []))
+        functions[-1][1].append(command)
+    return functions
+
+
+def reachable_functions(files, entry='Sys.init'):
+    # the names of the functions called directly or indirectly by `entry`,
+    # files = [(filename, [(function name, commands)])]
+    calls = {}
+    for _, functions in files:
+        for name, commands in functions:
+            calls.setdefault(name, set()).update(
+                command[2] for command in commands if command[1] == 'call')
+
+    reachable = set()
+    pending = [entry]
+    while pending:
+        name = pending.pop()
+        if name not in reachable and name in calls:
+            reachable.add(name)
+            pending.extend(calls[name])
+    return reachable
+
+
+def itranslate_file(generator, path, commands=None):
+    # the code blocks of a file of a project, translated on its own
+    if commands is None:
+        commands = Parser().parse_file(path)
+    filename = os.path.splitext(os.path.basename(path))[0]
+    return generator.itranslate(filename, commands)
+
+
+def translate_file(path, options, commands=None):
+    # runs in the worker processes, returns the code and the shared
+    # routines it needs
+    generator = CodeGenerator(separate=True, **options)
+    code = '\n'.join(itranslate_file(generator, path, commands))
+    return code, generator.used_routines
+
+
 class Translator:
-    def __init__(self):
+    # with prune a project is linked without the functions that can not be
+    # reached from Sys.init; the files of a project are translated by
+    # `jobs` processes and put together in the order of their names. The
+    # other options are passed to CodeGenerator.
+    def __init__(self, prune=False, jobs=1, **options):
+        self.prune = prune
+        self.jobs = jobs
+        self.options = options
+        self.instructions = 0
+        # the function names of the last project, all and linked
+        self.functions = set()
+        self.linked = set()
         self.__parser = None
         self.__generator = None
 
@@ -15,25 +85,41 @@ class Translator:
     @contextlib.contextmanager
     def __init_resorces(self):
         self.__parser = Parser()
-        self.__generator = CodeGenerator()
+        self.__generator = CodeGenerator(**self.options)
         yield
         self.__parser = None
         self.__generator = None
 
 
     def translate(self, path, dry_run=False):
+        # the path '-' translates the standard input to the standard output
+        blocks = self.itranslate(path)
+        if dry_run:
+            for _ in blocks:
+                pass
+        elif path == '-':
+            self.__write(blocks, sys.stdout)
+        else:
+            output = self.__make_output_name(path)
+            with open(output, 'w') as f:
+                self.__write(blocks, f)
+
+    def __write(self, blocks, f):
+        # block by block, the file object buffers the writes
+        for block in blocks:
+            f.write(block)
+            f.write('\n')
+
+    def itranslate(self, path):
+        # the emitted instructions are counted in `instructions`
+        self.instructions = 0
         with self.__init_resorces():
-            blocks = self.__translate(path)
+            yield from self.__count(self.__translate(path))
 
-            if dry_run:
-                for _ in blocks:
-                    pass
-            else:
-                output = self.__make_output_name(path)
-                with open(output, 'w') as f:
-                    for block in blocks:
-                        f.write(block)
-                        f.write('\n')
+    def __count(self, blocks):
+        for block in blocks:
+            self.instructions += count_instructions(block)
+            yield block
 
 
     def __translate(self, path):
@@ -45,13 +131,55 @@ class Translator:
 
     def __translate_project(self, path):
         yield self.__generator.gen_initializer()
-        for fname in glob.iglob(os.path.join(path, '*.vm')):
-            yield from self.__translate_file(fname)
+        fnames = sorted(glob.glob(os.path.join(path, '*.vm')))
+        sources = itertools.repeat(None)  # parsed by the workers
+        if self.prune:
+            sources = self.__link(fnames)
+
+        used_routines = set()
+        if self.jobs > 1 and len(fnames) > 1:
+            with concurrent.futures.ProcessPoolExecutor(self.jobs) as executor:
+                results = list(executor.map(translate_file, fnames,
+                    itertools.repeat(self.options), sources))
+            for code, routines in results:
+                yield code
+                used_routines |= routines
+        else:
+            # block by block, a file is never held in memory as a whole
+            for fname, commands in zip(fnames, sources):
+                generator = CodeGenerator(separate=True, **self.options)
+                yield from itranslate_file(generator, fname, commands)
+                used_routines |= generator.used_routines
+
+        routines = self.__generator.gen_routines(used_routines)
+        if routines:
+            yield routines
+
+
+    def __link(self, fnames):
+        # the commands of the functions reachable from Sys.init, by file
+        files = [(fname, split_functions(self.__parser.parse_file(fname)))
+            for fname in fnames]
+        self.functions = {name for _, functions in files
+            for name, _ in functions if name is not None}
+        self.linked = reachable_functions(files)
+        if 'Sys.init' not in self.linked:
+            # nothing to start from, keep everything
+            self.linked = set(self.functions)
+
+        return [[command for name, commands in functions
+                if name is None or name in self.linked
+                for command in commands]
+            for _, functions in files]
 
 
     def __translate_file(self, path):
-        filename = os.path.splitext(os.path.basename(path))[0]
-        commands = self.__parser.parse_file(path)
+        if path == '-':
+            filename = 'stdin'
+            commands = self.__parser.parse(sys.stdin)
+        else:
+            filename = os.path.splitext(os.path.basename(path))[0]
+            commands = self.__parser.parse_file(path)
         yield from self.__generator.itranslate(filename, commands)
 
 
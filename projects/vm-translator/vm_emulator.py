@@ -1,4 +1,6 @@
+import array
 import collections
+import collections.abc
 import keywords as kw
 
 
@@ -6,19 +8,130 @@ class MaxStepsExceededError(RuntimeError):
     pass
 
 
+def to_int16(value):
+    return ((value + 0x8000) & 0xffff) - 0x8000
+
+
+class FlatRAM(array.array):
+    # 32K 16-bit words, compares equal to a dict of its non-zero words
+    # (missing addresses are treated as 0).
+    #
+    # Negative addresses index from the end, which matches the Hack memory
+    # that only uses the lower 15 bits of A.
+    size = 32 * 1024
+
+    def __new__(cls):
+        return super().__new__(cls, 'h', bytes(2 * cls.size))
+
+    def __contains__(self, address):
+        return isinstance(address, int) and 0 <= address < self.size
+
+    def __delitem__(self, address):
+        self[address] = 0
+
+    def get(self, address, default=None):
+        if address in self:
+            return self[address]
+        return default
+
+    def items(self):
+        return ((address, value) for address, value in enumerate(self) if value)
+
+    def __eq__(self, other):
+        if isinstance(other, collections.abc.Mapping):
+            return (dict(self.items())
+                == {address: value for address, value in other.items() if value})
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _make_comps(wrap):
+    expressions = [
+        '0', '1', '-1',
+        'D', 'A', '!D', '!A', '-D', '-A',
+        'D+1', 'A+1', 'D-1', 'A-1',
+        'D+A', 'D-A', 'A-D', 'D&A', 'D|A',
+        # commutative aliases
+        'A+D', 'A&D', 'A|D', '1+D', '1+A',
+    ]
+    expressions += [e.replace('A', 'M') for e in expressions if 'A' in e]
+
+    comps = {}
+    for expression in expressions:
+        # `M` is read lazily, so that A/D-only computations don't touch the RAM
+        body = expression.replace('M', 'ram[A]').replace('!', '~')
+        if wrap:
+            body = f'((({body}) + 0x8000) & 0xffff) - 0x8000'
+        comps[expression] = eval(f'lambda A, D, ram: {body}')
+    return comps
+
+
+# comp -> fn(A, D, ram)
+_comps = _make_comps(wrap=False)
+_comps_int16 = _make_comps(wrap=True)
+
+_destinations = {
+    'A': 0b100,
+    'D': 0b010,
+    'M': 0b001,
+}
+
+_jumps = {
+    None:  0b000,
+    'JGT': 0b001,
+    'JEQ': 0b010,
+    'JGE': 0b011,
+    'JLT': 0b100,
+    'JNE': 0b101,
+    'JLE': 0b110,
+    'JMP': 0b111,
+}
+
+
+# with the flat RAM, A is a signed 16-bit value and, like the Hack ROM,
+# a jump only uses its lower 15 bits
+_rom_mask = 0x7fff
+
+_jump_conditions = {
+    'JGT': 'value > 0',
+    'JEQ': 'value == 0',
+    'JGE': 'value >= 0',
+    'JLT': 'value < 0',
+    'JNE': 'value != 0',
+    'JLE': 'value <= 0',
+}
+
+
 class VMEmulator:
     stack_offset = 256
 
-    def __init__(self, trace=False):
+    engines = ('decode', 'jit', 'interpret')
+    rams = ('sparse', 'flat')
+
+    def __init__(self, trace=False, engine='decode', ram='sparse'):
+        if engine not in self.engines:
+            raise ValueError(f'unknown engine: {engine}')
+        if ram not in self.rams:
+            raise ValueError(f'unknown ram: {ram}')
         self.trace = trace
+        self.engine = engine
+        self.ram_type = ram
         self.reset()
 
     def reset(self):
         self.pc = 0
-        self.ram = collections.defaultdict(int)
+        if self.ram_type == 'flat':
+            # registers wrap around to 16 bits as well
+            self.ram = FlatRAM()
+        else:
+            self.ram = collections.defaultdict(int)
         self.A = 0
         self.D = 0
         self.symbols = dict(**kw.constants)
+        self.blocks_compiled = 0
+        self.blocks_executed = 0
 
         self.ram[self.symbols['SP']] = self.stack_offset
 
@@ -35,12 +148,12 @@ class VMEmulator:
         self._resolve_labels(instructions)
         self._resolve_variables(instructions)
 
-        finished = False
-        for _ in range(max_steps):
-            if self.pc >= len(instructions):
-                finished = True
-                break
-            self._execute_instruction(instructions[self.pc])
+        if self.engine == 'decode':
+            finished = self._run_decoded(instructions, max_steps)
+        elif self.engine == 'jit':
+            finished = self._run_jit(instructions, max_steps)
+        else:
+            finished = self._run_interpreted(instructions, max_steps)
 
         if not finished:
             raise MaxStepsExceededError(max_steps)
@@ -79,6 +192,221 @@ class VMEmulator:
                         self.symbols[name] = i
                         i += 1
 
+    def _run_interpreted(self, instructions, max_steps):
+        for _ in range(max_steps):
+            if self.pc >= len(instructions):
+                return True
+            self._execute_instruction(instructions[self.pc])
+        return False
+
+    def _run_decoded(self, instructions, max_steps):
+        program = [self._decode_instruction(pc, instruction)
+            for pc, instruction in enumerate(instructions)]
+        size = len(program)
+
+        pc = self.pc
+        try:
+            for _ in range(max_steps):
+                if pc >= size:
+                    return True
+                pc = program[pc]()
+            return False
+        finally:
+            self.pc = pc
+
+    def _decode_instruction(self, pc, instruction):
+        # each instruction is decoded once into a closure that executes it
+        # and returns the next pc
+        trace = self.trace
+        rom_mask = _rom_mask if self.ram_type == 'flat' else -1
+
+        if instruction.startswith('@'):
+            address = instruction[1:]
+            try:
+                address = int(address)
+            except ValueError:
+                address = self.symbols[address]
+
+            def execute():
+                self.A = address
+                if trace:
+                    self.__print_a_instruction(pc, instruction, address)
+                return pc + 1
+
+        elif instruction.startswith('('):
+            def execute():
+                if trace:
+                    self.__print_label(pc, instruction)
+                return pc + 1
+
+        else:
+            dest, comp, jmp = self._decode_c_instruction(instruction)
+            dest_bits = sum(_destinations[reg] for reg in dest or '')
+            jmp_bits = _jumps[jmp]
+
+            def execute():
+                ram = self.ram
+                A = self.A
+                value = comp(A, self.D, ram)
+                if trace:
+                    self.__print_c_instruction(pc, instruction, dest, value, jmp)
+
+                # M is written first, since it's addressed by the old A
+                if dest_bits & 0b001:
+                    ram[A] = value
+                if dest_bits & 0b010:
+                    self.D = value
+                if dest_bits & 0b100:
+                    self.A = value
+
+                if jmp_bits:
+                    if value < 0:
+                        condition = 0b100
+                    elif value == 0:
+                        condition = 0b010
+                    else:
+                        condition = 0b001
+                    if jmp_bits & condition:
+                        return self.A & rom_mask
+                return pc + 1
+
+        return execute
+
+    def _decode_c_instruction(self, instruction):
+        dest, comp, jmp = self._split_c_instruction(instruction)
+        comps = _comps_int16 if self.ram_type == 'flat' else _comps
+        return dest, comps[comp], jmp
+
+    def _split_c_instruction(self, instruction):
+        if ';' in instruction:
+            cmd, jmp = instruction.split(';')
+            jmp = jmp.strip()
+        else:
+            cmd = instruction
+            jmp = None
+
+        cmd = cmd.replace(' ', '')
+        if '=' in cmd:
+            dest, comp = cmd.split('=')
+        else:
+            comp = cmd
+            dest = None
+
+        if comp not in _comps or jmp not in _jumps:
+            raise RuntimeError(f'invalid instruction: {instruction}')
+        if dest and (set(dest) - set(_destinations) or len(set(dest)) != len(dest)):
+            raise RuntimeError(f'invalid instruction: {instruction}')
+        return dest, comp, jmp
+
+    def _run_jit(self, instructions, max_steps):
+        # basic blocks are compiled on first entry and cached by their
+        # entry pc, a block ends with a jump or right before a label
+        blocks = {}
+        size = len(instructions)
+
+        pc = self.pc
+        steps = 0
+        try:
+            while pc < size:
+                block = blocks.get(pc)
+                if block is None:
+                    block = blocks[pc] = self._compile_block(instructions, pc)
+                    self.blocks_compiled += 1
+
+                execute, length = block
+                if steps + length > max_steps:
+                    # not enough steps left for the whole block
+                    break
+                pc = execute()
+                steps += length
+                self.blocks_executed += 1
+            else:
+                return True
+
+            for _ in range(max_steps - steps):
+                if pc >= size:
+                    return True
+                pc = self._decode_instruction(pc, instructions[pc])()
+            return False
+        finally:
+            self.pc = pc
+
+    def _compile_block(self, instructions, entry):
+        wrap = self.ram_type == 'flat'
+        trace = self.trace
+
+        lines = [
+            'def block():',
+            '    ram = vm.ram',
+            '    A = vm.A',
+            '    D = vm.D',
+        ]
+        def emit(line):
+            lines.append('    ' + line)
+
+        pc = entry
+        next_pc = None
+        while pc < len(instructions):
+            instruction = instructions[pc]
+
+            if instruction.startswith('('):
+                if pc != entry:
+                    break
+                if trace:
+                    emit(f'trace_label({pc}, {instruction!r})')
+
+            elif instruction.startswith('@'):
+                address = instruction[1:]
+                try:
+                    address = int(address)
+                except ValueError:
+                    address = self.symbols[address]
+                emit(f'A = {address}')
+                if trace:
+                    emit(f'trace_a({pc}, {instruction!r}, A)')
+
+            else:
+                dest, comp, jmp = self._split_c_instruction(instruction)
+                value = comp.replace('M', 'ram[A]').replace('!', '~')
+                if wrap:
+                    value = f'((({value}) + 0x8000) & 0xffff) - 0x8000'
+
+                emit(f'value = {value}')
+                if trace:
+                    emit(f'trace_c({pc}, {instruction!r}, {dest!r}, value, {jmp!r})')
+                # M is written first, since it's addressed by the old A
+                for reg, target in [('M', 'ram[A]'), ('D', 'D'), ('A', 'A')]:
+                    if reg in (dest or ''):
+                        emit(f'{target} = value')
+
+                if jmp:
+                    emit('vm.A = A')
+                    emit('vm.D = D')
+                    target = f'A & {_rom_mask}' if wrap else 'A'
+                    if jmp == 'JMP':
+                        emit(f'return {target}')
+                    else:
+                        emit(f'return {target} if {_jump_conditions[jmp]}'
+                            f' else {pc + 1}')
+                    next_pc = pc + 1
+                    break
+            pc += 1
+
+        if next_pc is None:
+            emit('vm.A = A')
+            emit('vm.D = D')
+            emit(f'return {pc}')
+            next_pc = pc
+
+        namespace = {
+            'vm': self,
+            'trace_a': self.__print_a_instruction,
+            'trace_c': self.__print_c_instruction,
+            'trace_label': self.__print_label,
+        }
+        exec(compile('\n'.join(lines), f'<block {entry}>', 'exec'), namespace)
+        return namespace['block'], next_pc - entry
+
     def _execute_instruction(self, instruction):
         if instruction.startswith('@'):
             self._execute_a_instruction(instruction)
@@ -114,21 +442,31 @@ class VMEmulator:
 
         if '=' in cmd:
             dest, comp = cmd.split('=')
+            dest = dest.replace('self.', '').strip()
         else:
             comp = cmd
             dest = None
 
         value = eval(comp)
+        if self.ram_type == 'flat':
+            value = to_int16(value)
         self.__print_c_instruction(self.pc, instruction, dest, value, jmp)
 
-        if dest:
-            exec(f'{dest}={value}')
+        # AM=..., AMD=...: M is written at the address before A changes
+        if dest and 'M' in dest:
+            self.M = value
+        if dest and 'D' in dest:
+            self.D = value
+        if dest and 'A' in dest:
+            self.A = value
         if (jmp == 'JMP'
             or (value < 0 and jmp in {'JLT', 'JLE', 'JNE'})
             or (value > 0 and jmp in {'JGT', 'JGE', 'JNE'})
             or (value == 0 and jmp in {'JLE', 'JEQ', 'JGE'})
             ):
             self.pc = self.A
+            if self.ram_type == 'flat':
+                self.pc &= _rom_mask
         else:
             self.pc += 1
 
@@ -136,7 +474,7 @@ class VMEmulator:
     def __print_c_instruction(self, pc, instruction, dest, value, jmp):
         if self.trace:
             if dest:
-                cmd = f'{dest.split(".")[1]}={value}'
+                cmd = f'{dest}={value}'
             else:
                 cmd = str(value)
             if jmp: